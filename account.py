@@ -0,0 +1,101 @@
+# 口座資産スナップショット
+# /v1/account/assets の結果（日本円と全通貨）をTTL付きでメモリとSQLiteに保持し、
+# 残高警告・発注前の残高確認・評価額計算で共有する。
+# 別プロセスもSQLite上のスナップショットを再利用するため、TTL内はAPIを呼ばない。
+
+import json
+import time
+import logging
+import threading
+from decimal import Decimal
+from config import settings
+from api_client import get_account_assets
+
+logger = logging.getLogger(__name__)
+
+
+class AccountService:
+    def __init__(self, ttl=60.0, order_margin_percent=1.0):
+        self.ttl = ttl
+        self.order_margin_percent = Decimal(str(order_margin_percent))
+        self._assets = None
+        self._fetched_at = None
+        self._lock = threading.Lock()
+
+    # --- スナップショット取得（メモリ → SQLite → API の順） ---
+    def snapshot(self, db, force=False):
+        with self._lock:
+            now = time.time()
+            if not force and self._is_fresh(self._fetched_at, now):
+                return self._assets
+
+            if not force:
+                row = db.get_account_snapshot()
+                if row and self._is_fresh(row[0], now):
+                    self._fetched_at, self._assets = row[0], json.loads(row[1])
+                    return self._assets
+
+            assets = get_account_assets()
+            if assets is None:
+                return None
+            self._fetched_at, self._assets = now, assets
+            db.save_account_snapshot(now, json.dumps(assets))
+            return assets
+
+    def _is_fresh(self, fetched_at, now):
+        return fetched_at is not None and now - fetched_at < self.ttl
+
+    def jpy_balance(self, db):
+        assets = self.snapshot(db)
+        if assets is None or "JPY" not in assets:
+            return None
+        return Decimal(assets["JPY"]["amount"])
+
+    # --- 発注前の残高確認（取得できない場合は取引所の判定に委ねる） ---
+    def can_afford(self, db, jpy):
+        assets = self.snapshot(db)
+        if assets is None or "JPY" not in assets:
+            logger.warning("口座資産が取得できないため、残高確認をスキップします")
+            return True
+        available = Decimal(assets["JPY"]["available"])
+        required = Decimal(jpy) * (1 + self.order_margin_percent / 100)
+        return available >= required
+
+    # --- 発注した金額をスナップショットの利用可能残高から差し引く ---
+    # 次の残高確認でAPIを呼ばずに済むよう、約定を待たずに見込みで反映する
+    def reserve(self, db, jpy):
+        with self._lock:
+            if self._assets is None or "JPY" not in self._assets:
+                return
+            jpy_asset = self._assets["JPY"]
+            jpy_asset["available"] = str(Decimal(jpy_asset["available"]) - Decimal(jpy))
+            db.save_account_snapshot(self._fetched_at, json.dumps(self._assets))
+
+    # --- 発注しなかった・拒否された金額を利用可能残高に戻す ---
+    def release(self, db, jpy):
+        self.reserve(db, -Decimal(jpy))
+
+    # --- 保有資産の評価額（円）。価格がない通貨は取引所の換算レートを使う ---
+    def portfolio_value(self, db, prices):
+        assets = self.snapshot(db)
+        if assets is None:
+            return None
+        values = {}
+        for symbol, asset in assets.items():
+            amount = Decimal(asset["amount"])
+            if amount == 0:
+                continue
+            if symbol == "JPY":
+                values[symbol] = amount
+            elif prices.get(symbol) is not None:
+                values[symbol] = amount * prices[symbol]
+            elif asset.get("conversion_rate"):
+                values[symbol] = amount * Decimal(asset["conversion_rate"])
+        return values
+
+
+_account_cfg = settings.get("account", {})
+account_service = AccountService(
+    ttl=_account_cfg.get("snapshot_ttl_seconds", 60),
+    order_margin_percent=_account_cfg.get("order_margin_percent", 1.0),
+)
@@ -1,49 +1,70 @@
-import requests
 import time
 import json
 import logging
 import random
 from decimal import Decimal
-from datetime import datetime, timedelta
-from config import HEADERS, ORDER_URL, generate_signature
+from datetime import datetime, timedelta, timezone
+from config import HEADERS, ORDER_URL, DATA_DIR, settings, generate_signature
+from response_cache import ResponseCache
+from db_manager import DBManager
+from price_feed import COINGECKO_IDS, build_price_feed
+from resilience import build_client
 
 logger = logging.getLogger(__name__)
 
+# --- 過去価格レスポンスのキャッシュ ---
+_cache_cfg = (settings or {}).get("http_cache", {})
+response_cache = (
+    ResponseCache(DATA_DIR, max_bytes=_cache_cfg.get("max_bytes", 10_000_000))
+    if _cache_cfg.get("enabled", True)
+    else None
+)
+TODAY_TTL_SECONDS = _cache_cfg.get("today_ttl_seconds", 600)
+
+# --- API呼び出しの耐障害レイヤー（リトライ・サーキットブレーカー・期限） ---
+http_client = build_client((settings or {}).get("resilience"))
+
+# --- 現在価格フィード（主系GMO＋予備系） ---
+# 予備系の価格しか得られない場合は、この時間以内の短期価格と照合する
+REFERENCE_MAX_AGE = timedelta(hours=24)
+_reference_db = DBManager(DATA_DIR)
 
-# --- 現在価格の取得（パブリックAPI） ---
-def get_current_prices(symbols):
-    result = {}
-    for symbol in symbols:
-        try:
-            url = f"https://api.coin.z.com/public/v1/ticker?symbol={symbol}_JPY"
-            resp = requests.get(url, timeout=5)
-            resp.raise_for_status()
-            data = resp.json()
-            result[symbol] = Decimal(data["data"][0]["last"])
-        except Exception as e:
-            logger.error(f"{symbol}価格取得エラー: {e}")
-    return result
 
+def _reference_prices(symbols):
+    since = (datetime.now() - REFERENCE_MAX_AGE).strftime("%Y-%m-%d %H:%M:%S")
+    return _reference_db.get_latest_short_term_price_map(symbols, since)
 
-# --- 日本円残高の取得（プライベートAPI） ---
-def get_jpy_balance():
-    timestamp = str(int(time.time() * 1000))
-    method = "GET"
-    endpoint = "/v1/account/assets"
-    body = ""
 
-    signature = generate_signature(timestamp, method, endpoint, body)
-    headers = HEADERS.copy()
-    headers.update({"API-TIMESTAMP": timestamp, "API-SIGN": signature})
+price_feed = build_price_feed(
+    (settings or {}).get("price_feed"), client=http_client, reference=_reference_prices
+)
 
+
+# --- 現在価格の取得（パブリックAPI） ---
+def get_current_prices(symbols):
+    return price_feed.get_prices(symbols)
+
+
+# --- 口座資産の取得（プライベートAPI、日本円と全通貨） ---
+def get_account_assets():
     try:
         url = "https://api.coin.z.com/private/v1/account/assets"
-        resp = requests.get(url, headers=headers, timeout=5)
+        resp = http_client.request(
+            "GET",
+            url,
+            prepare=_signer("GET", "/v1/account/assets"),
+            gmo=True,
+            timeout=5,
+        )
         resp.raise_for_status()
-        assets = resp.json()["data"]
-        for asset in assets:
-            if asset.get("symbol") == "JPY":
-                return Decimal(asset["amount"])
+        return {
+            asset["symbol"]: {
+                "amount": asset["amount"],
+                "available": asset.get("available", asset["amount"]),
+                "conversion_rate": asset.get("conversionRate"),
+            }
+            for asset in resp.json()["data"]
+        }
     except Exception as e:
         logger.error(f"残高取得エラー: {e}")
         return None
@@ -58,14 +79,18 @@ def place_order(symbol, size: Decimal):
         "size": str(size),
     }
     body_json = json.dumps(body)
-    timestamp = str(int(time.time() * 1000))
-    signature = generate_signature(timestamp, "POST", "/v1/order", body_json)
-
-    headers = HEADERS.copy()
-    headers.update({"API-TIMESTAMP": timestamp, "API-SIGN": signature})
 
     try:
-        response = requests.post(ORDER_URL, headers=headers, data=body_json, timeout=5)
+        # 注文は冪等でないため、処理前に拒否されたことが明らかな場合のみ再送される
+        response = http_client.request(
+            "POST",
+            ORDER_URL,
+            prepare=_signer("POST", "/v1/order", body_json),
+            idempotent=False,
+            gmo=True,
+            timeout=5,
+            data=body_json,
+        )
         if response.status_code == 200:
             json_data = response.json()
             order_id = json_data.get("data")
@@ -77,29 +102,80 @@ def place_order(symbol, size: Decimal):
         raise
 
 
-# --- CoinGeckoから過去価格を取得 ---
+# --- CoinGeckoから過去価格を取得（戻り値: 価格, 通信したか） ---
 def get_historical_price(symbol, date_str):
-    coingecko_map = {
-        "BTC": "bitcoin",
-        "ETH": "ethereum",
-        "BCH": "bitcoin-cash",
-        "LTC": "litecoin",
-        "XRP": "ripple",
-        "ADA": "cardano",
-        "DOT": "polkadot",
-        "SOL": "solana",
-        "LINK": "chainlink",
-        "DOGE": "dogecoin",
-    }
-    cg_id = coingecko_map.get(symbol.upper())
-    if not cg_id:
-        raise ValueError(f"{symbol} はCoinGecko非対応です")
+    cg_id = _coingecko_id(symbol)
 
     url = f"https://api.coingecko.com/api/v3/coins/{cg_id}/history?date={datetime.strptime(date_str, '%Y-%m-%d').strftime('%d-%m-%Y')}"  # noqa: E501
-    resp = requests.get(url, timeout=10)
+    data, fetched = _get_json_cached(
+        f"coingecko:history:{cg_id}:{date_str}",
+        url,
+        date_str,
+        complete=lambda d: "market_data" in d,
+    )
+    return Decimal(str(data["market_data"]["current_price"]["jpy"])), fetched
+
+
+# --- CoinGeckoから期間内の日次価格を一括取得（戻り値: 日付→価格, 通信したか） ---
+def get_historical_prices(symbol, start_date, end_date):
+    cg_id = _coingecko_id(symbol)
+    start = datetime.strptime(start_date, "%Y-%m-%d").replace(tzinfo=timezone.utc)
+    end = datetime.strptime(end_date, "%Y-%m-%d").replace(tzinfo=timezone.utc)
+    url = f"https://api.coingecko.com/api/v3/coins/{cg_id}/market_chart/range"
+    params = {
+        "vs_currency": "jpy",
+        "from": int(start.timestamp()),
+        "to": int((end + timedelta(days=1)).timestamp()) - 1,
+    }
+    data, fetched = _get_json_cached(
+        f"coingecko:range:{cg_id}:{start_date}:{end_date}",
+        url,
+        end_date,
+        params,
+        complete=lambda d: bool(d.get("prices")),
+    )
+
+    # 日付ごとに最初の値（UTC 0時 = 日本時間9時付近）を採用する
+    result = {}
+    for ts_ms, price in data.get("prices", []):
+        day = datetime.fromtimestamp(ts_ms / 1000, tz=timezone.utc)
+        date_str = day.strftime("%Y-%m-%d")
+        if start_date <= date_str <= end_date and date_str not in result:
+            result[date_str] = Decimal(str(price))
+    return result, fetched
+
+
+# --- キャッシュ経由のGET（当日を含む範囲・価格を含まない応答はTTLを設定） ---
+# complete: 応答に価格が含まれているかを判定する関数。空の応答を無期限に保持しない
+# 戻り値: (応答, APIへ問い合わせたか)。キャッシュから返した場合は待機不要
+def _get_json_cached(key, url, last_date, params=None, complete=None):
+    if response_cache is not None:
+        body = response_cache.get(key)
+        if body is not None:
+            return json.loads(body), False
+
+    resp = http_client.request("GET", url, params=params, timeout=10)
     resp.raise_for_status()
+
     data = resp.json()
-    return Decimal(str(data["market_data"]["current_price"]["jpy"]))
+    if response_cache is not None:
+        today = datetime.now().strftime("%Y-%m-%d")
+        final = last_date < today and (complete is None or complete(data))
+        response_cache.put(key, resp.text, ttl=None if final else TODAY_TTL_SECONDS)
+    return data, True
+
+
+def get_cache_stats():
+    if response_cache is None:
+        return None
+    return response_cache.stats()
+
+
+def _coingecko_id(symbol):
+    cg_id = COINGECKO_IDS.get(symbol.upper())
+    if not cg_id:
+        raise ValueError(f"{symbol} はCoinGecko非対応です")
+    return cg_id
 
 
 # --- 必要な履歴数に満たない場合、過去の価格を補完 ---
@@ -112,33 +188,96 @@ def initialize_price_history_if_needed(symbol, db, required_days=15, force=False
     logger.info(
         f"{symbol} の価格履歴が {required_days} 件未満です。過去価格を取得します。"
     )
+    # CoinGeckoの呼び出し制限のため、APIへ問い合わせた後のみ待機する
+    throttle = False
     for i in range(required_days):
         target_date = (datetime.now() - timedelta(days=i)).strftime("%Y-%m-%d")
+        if throttle:
+            time.sleep(random.uniform(12.0, 15.0))
         try:
-            price = get_historical_price(symbol, target_date)
+            price, throttle = get_historical_price(symbol, target_date)
             db.record_price_history(symbol, price, date=target_date)
             logger.info(f"{symbol} {target_date} = {price} 円")
-            time.sleep(random.uniform(12.0, 15.0))
         except Exception as e:
+            throttle = True
             logger.warning(f"{target_date} の {symbol} 価格取得失敗: {e}")
 
 
+# --- 価格履歴の欠損区間を検出し、区間ごとに一括で補完 ---
+def backfill_price_history_gaps(db, symbols, required_days=37):
+    # 当日分は record-price（短期価格の集計）で翌日に確定するため前日までを対象にする
+    end = datetime.now() - timedelta(days=1)
+    start_date = (end - timedelta(days=required_days - 1)).strftime("%Y-%m-%d")
+    end_date = end.strftime("%Y-%m-%d")
+
+    gaps = db.find_price_history_gaps(symbols, start_date, end_date)
+    if not gaps:
+        logger.info("価格履歴に欠損はありません。")
+        return 0
+
+    filled = 0
+    # CoinGeckoの呼び出し制限のため、APIへ問い合わせた後のみ待機する
+    throttle = False
+    for symbol, gap_start, gap_end in gaps:
+        if throttle:
+            time.sleep(random.uniform(12.0, 15.0))
+        logger.info(f"{symbol} の価格履歴欠損を補完します: {gap_start} 〜 {gap_end}")
+        try:
+            prices, throttle = get_historical_prices(symbol, gap_start, gap_end)
+        except Exception as e:
+            throttle = True
+            logger.warning(f"{symbol} {gap_start}〜{gap_end} の価格取得失敗: {e}")
+            continue
+
+        # 区間内の全日分を1トランザクションで記録する
+        rows = [(symbol, price, date_str) for date_str, price in sorted(prices.items())]
+        results = db.record_price_histories(rows)
+        filled += sum(1 for error in results if error is None)
+        missing = (
+            datetime.strptime(gap_end, "%Y-%m-%d")
+            - datetime.strptime(gap_start, "%Y-%m-%d")
+        ).days + 1
+        if len(prices) < missing:
+            logger.warning(
+                f"{symbol} {gap_start}〜{gap_end} のうち "
+                f"{missing - len(prices)} 日分は補完できませんでした"
+            )
+    return filled
+
+
 def get_executions_by_order(order_id):
     base_url = "https://api.coin.z.com"
     endpoint = "/private/v1/executions"
     query = f"?orderId={order_id}"
-    timestamp = str(int(time.time() * 1000))
-    signature = generate_signature(timestamp, "GET", "/v1/executions", "")
-
-    headers = HEADERS.copy()
-    headers.update({"API-TIMESTAMP": timestamp, "API-SIGN": signature})
 
     url = base_url + endpoint + query
 
     try:
-        resp = requests.get(url, headers=headers, timeout=5)
+        resp = http_client.request(
+            "GET", url, prepare=_signer("GET", "/v1/executions"), gmo=True, timeout=5
+        )
         resp.raise_for_status()
         return resp.json().get("data", {}).get("list", [])
     except Exception as e:
         logger.error(f"約定情報取得エラー: {e}")
         return []
+
+
+# --- 試行ごとに署名付きヘッダを生成する ---
+def _signer(method, endpoint, body=""):
+    def prepare():
+        timestamp = str(int(time.time() * 1000))
+        signature = generate_signature(timestamp, method, endpoint, body)
+        headers = HEADERS.copy()
+        headers.update({"API-TIMESTAMP": timestamp, "API-SIGN": signature})
+        return {"headers": headers}
+
+    return prepare
+
+
+def get_api_metrics():
+    return http_client.metrics()
+
+
+def get_price_feed_stats():
+    return dict(price_feed.stats)
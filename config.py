@@ -5,6 +5,7 @@ import hmac
 import hashlib
 import sys
 from dotenv import load_dotenv
+from indicators import INDICATORS
 
 logger = logging.getLogger(__name__)
 
@@ -30,6 +31,33 @@ def load_json(path, default=None):
         return default
 
 
+# --- 分割注文（TWAP）設定のバリデーション ---
+def validate_execution(section, symbol, execution):
+    if not isinstance(execution, dict):
+        logger.error(f"{section}の 'execution' は辞書である必要があります ({symbol})")
+        sys.exit(1)
+    slices = execution.get("slices", 1)
+    if not isinstance(slices, int) or slices < 1:
+        logger.error(
+            f"{section}.executionの 'slices' は1以上の整数である必要があります ({symbol})"  # noqa: E501
+        )
+        sys.exit(1)
+    interval = execution.get("interval_seconds", 60)
+    if not isinstance(interval, (int, float)) or interval < 0:
+        logger.error(
+            f"{section}.executionの 'interval_seconds' は0以上の数値である必要があります ({symbol})"  # noqa: E501
+        )
+        sys.exit(1)
+    if "max_slippage_percent" in execution and (
+        not isinstance(execution["max_slippage_percent"], (int, float))
+        or execution["max_slippage_percent"] <= 0
+    ):
+        logger.error(
+            f"{section}.executionの 'max_slippage_percent' は正の数値である必要があります ({symbol})"  # noqa: E501
+        )
+        sys.exit(1)
+
+
 # --- 設定バリデーション関数 ---
 def validate_settings(settings):
     logger.info("設定ファイルのバリデーションを開始...")
@@ -44,6 +72,8 @@ def validate_settings(settings):
         if cfg["jpy"] < 0 or cfg["interval_days"] < 1 or cfg["min_order_amount"] <= 0:
             logger.error(f"base_purchase設定エラー ({symbol}): {cfg}")
             sys.exit(1)
+        if "execution" in cfg:
+            validate_execution("base_purchase", symbol, cfg["execution"])
 
     add_settings = settings.get("add_purchase", {}).get("settings", {})
     required_keys_add = [
@@ -62,6 +92,54 @@ def validate_settings(settings):
         if cfg["jpy"] < 0 or cfg["min_order_amount"] <= 0 or cfg["min_score"] < 0:
             logger.error(f"add_purchase設定エラー ({symbol}): {cfg}")
             sys.exit(1)
+        if "execution" in cfg:
+            validate_execution("add_purchase", symbol, cfg["execution"])
+
+        rules = cfg.get("rules")
+        if rules is not None:
+            if not isinstance(rules, list) or not rules:
+                logger.error(
+                    f"add_purchaseの 'rules' は空でないリストである必要があります ({symbol})"  # noqa: E501
+                )
+                sys.exit(1)
+            for rule in rules:
+                if (
+                    not isinstance(rule, dict)
+                    or rule.get("indicator") not in INDICATORS
+                ):
+                    logger.error(
+                        f"add_purchase.rulesの指標が不正です ({symbol}): {rule}"
+                        f" / 利用可能: {', '.join(sorted(INDICATORS))}"
+                    )
+                    sys.exit(1)
+                for k, v in rule.items():
+                    if k != "indicator" and not isinstance(v, (int, float)):
+                        logger.error(
+                            f"add_purchase.rulesの '{k}' は数値である必要があります ({symbol})"  # noqa: E501
+                        )
+                        sys.exit(1)
+
+        intraday = cfg.get("intraday")
+        if intraday is not None:
+            if not isinstance(intraday, dict):
+                logger.error(
+                    f"add_purchaseの 'intraday' は辞書である必要があります ({symbol})"
+                )
+                sys.exit(1)
+            for k in ("interval_minutes", "period"):
+                if k in intraday and (
+                    not isinstance(intraday[k], int) or intraday[k] < 1
+                ):
+                    logger.error(
+                        f"add_purchase.intradayの '{k}' は1以上の整数である必要があります ({symbol})"  # noqa: E501
+                    )
+                    sys.exit(1)
+            for k in ("rsi_threshold", "band_sigma"):
+                if k in intraday and not isinstance(intraday[k], (int, float)):
+                    logger.error(
+                        f"add_purchase.intradayの '{k}' は数値である必要があります ({symbol})"  # noqa: E501
+                    )
+                    sys.exit(1)
 
     if not isinstance(settings.get("mail", {}).get("enabled"), bool):
         logger.error("mail設定の 'enabled' はboolである必要があります")
@@ -89,6 +167,127 @@ def validate_settings(settings):
         logger.error("alertcheckの 'enabled_symbols' はリストである必要があります")
         sys.exit(1)
 
+    # --- http_cache ---
+    http_cache = settings.get("http_cache", {})
+
+    if "enabled" in http_cache and not isinstance(http_cache["enabled"], bool):
+        logger.error("http_cacheの 'enabled' はboolである必要があります")
+        sys.exit(1)
+
+    for k in ("max_bytes", "today_ttl_seconds"):
+        if k in http_cache and (
+            not isinstance(http_cache[k], int) or http_cache[k] < 0
+        ):
+            logger.error(f"http_cacheの '{k}' は0以上の整数である必要があります")
+            sys.exit(1)
+
+    # --- price_feed ---
+    price_feed = settings.get("price_feed", {})
+    known_providers = ("gmo", "coingecko")
+
+    providers = [price_feed.get("primary", "gmo")] + price_feed.get("backups", [])
+    if any(p not in known_providers for p in providers):
+        logger.error(
+            f"price_feedの取得元は {known_providers} のいずれかである必要があります"
+        )
+        sys.exit(1)
+
+    for k in ("hedge_delay_seconds", "timeout_seconds", "max_divergence_percent"):
+        if k in price_feed and (
+            not isinstance(price_feed[k], (int, float)) or price_feed[k] <= 0
+        ):
+            logger.error(f"price_feedの '{k}' は正の数値である必要があります")
+            sys.exit(1)
+
+    # --- resilience ---
+    resilience = settings.get("resilience", {})
+
+    for k in ("max_attempts", "failure_threshold"):
+        if k in resilience and (
+            not isinstance(resilience[k], int) or resilience[k] < 1
+        ):
+            logger.error(f"resilienceの '{k}' は1以上の整数である必要があります")
+            sys.exit(1)
+
+    for k in (
+        "base_delay_seconds",
+        "max_delay_seconds",
+        "reset_timeout_seconds",
+        "run_deadline_seconds",
+    ):
+        if k in resilience and (
+            not isinstance(resilience[k], (int, float)) or resilience[k] <= 0
+        ):
+            logger.error(f"resilienceの '{k}' は正の数値である必要があります")
+            sys.exit(1)
+
+    # --- logging ---
+    log_cfg = settings.get("logging", {})
+
+    if "json" in log_cfg and not isinstance(log_cfg["json"], bool):
+        logger.error("loggingの 'json' はboolである必要があります")
+        sys.exit(1)
+
+    retention_days = log_cfg.get("retention_days", 365)
+    if not isinstance(retention_days, int) or retention_days < 1:
+        logger.error("loggingの 'retention_days' は1以上の整数である必要があります")
+        sys.exit(1)
+
+    # --- dashboard ---
+    dashboard = settings.get("dashboard", {})
+    if "host" in dashboard and not isinstance(dashboard["host"], str):
+        logger.error("dashboardの 'host' は文字列である必要があります")
+        sys.exit(1)
+    port = dashboard.get("port", 8050)
+    if not isinstance(port, int) or not 0 < port < 65536:
+        logger.error("dashboardの 'port' は1〜65535の整数である必要があります")
+        sys.exit(1)
+
+    # --- coordinator ---
+    ttl = settings.get("coordinator", {}).get("lease_ttl_seconds", 120)
+    if not isinstance(ttl, (int, float)) or ttl <= 0:
+        logger.error("coordinatorの 'lease_ttl_seconds' は正の数値である必要があります")
+        sys.exit(1)
+
+    # --- price_history ---
+    daily_price = settings.get("price_history", {}).get("daily_price", "twap")
+    if daily_price not in ("close", "twap"):
+        logger.error(
+            "price_historyの 'daily_price' は 'close' または 'twap' である必要があります"
+        )
+        sys.exit(1)
+    min_samples = settings.get("price_history", {}).get("min_samples", 24)
+    if not isinstance(min_samples, int) or min_samples < 1:
+        logger.error("price_historyの 'min_samples' は1以上の整数である必要があります")
+        sys.exit(1)
+    coverage = settings.get("price_history", {}).get("min_coverage_hours", 18)
+    if not isinstance(coverage, (int, float)) or not 0 <= coverage < 24:
+        logger.error(
+            "price_historyの 'min_coverage_hours' は0以上24未満の数値である必要があります"
+        )
+        sys.exit(1)
+
+    # --- archive ---
+    hot_days = settings.get("archive", {}).get("hot_days", 90)
+    if not isinstance(hot_days, int) or hot_days < 40:
+        logger.error("archiveの 'hot_days' は40以上の整数である必要があります")
+        sys.exit(1)
+
+    # --- account ---
+    account = settings.get("account", {})
+    ttl = account.get("snapshot_ttl_seconds", 60)
+    if not isinstance(ttl, (int, float)) or ttl < 0:
+        logger.error(
+            "accountの 'snapshot_ttl_seconds' は0以上の数値である必要があります"
+        )
+        sys.exit(1)
+    margin = account.get("order_margin_percent", 1.0)
+    if not isinstance(margin, (int, float)) or margin < 0:
+        logger.error(
+            "accountの 'order_margin_percent' は0以上の数値である必要があります"
+        )
+        sys.exit(1)
+
     logger.info("設定ファイルバリデーション完了")
 
 
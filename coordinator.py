@@ -0,0 +1,41 @@
+# 実行コーディネーター
+# SQLite上のリースで同一モードの多重起動を防ぎ、ハートビートで期限を延長する。
+
+import os
+import uuid
+import socket
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# --- このプロセスの識別子（リース・購入キーの所有者） ---
+OWNER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+class RunLease:
+    def __init__(self, db, mode, ttl=120.0):
+        self.db = db
+        self.mode = mode
+        self.ttl = ttl
+        self._stop = threading.Event()
+        self._thread = None
+
+    def acquire(self):
+        if not self.db.acquire_lease(self.mode, OWNER_ID, self.ttl):
+            return False
+        self._thread = threading.Thread(target=self._heartbeat, daemon=True)
+        self._thread.start()
+        logger.info(f"実行リースを取得しました: {self.mode} ({OWNER_ID})")
+        return True
+
+    def _heartbeat(self):
+        while not self._stop.wait(self.ttl / 3):
+            if not self.db.renew_lease(self.mode, OWNER_ID, self.ttl):
+                logger.error(f"実行リースの延長に失敗しました: {self.mode}")
+
+    def release(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.db.release_lease(self.mode, OWNER_ID)
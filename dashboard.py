@@ -0,0 +1,298 @@
+# 履歴閲覧用の読み取り専用HTTPサーバー
+# 共有の読み取り専用接続でhistory.dbを参照し、集計結果をメモリにキャッシュする。
+# キャッシュは PRAGMA data_version（他接続のコミットで変化）で書き込みを検知して破棄する。
+# 短期価格・購入履歴は月別アーカイブも読み取り専用で参照する（アーカイブ処理は本体DBも
+# 更新するため、本体の data_version でまとめて検知できる）。
+
+import os
+import json
+import sqlite3
+import logging
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+from db_manager import (
+    DB_FILENAME,
+    ARCHIVE_DIRNAME,
+    archive_path,
+    list_archive_months,
+)
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_POINTS = 500
+MAX_POINTS = 5000
+MAX_CACHE_ENTRIES = 256
+
+
+class HistoryReader:
+    def __init__(self, data_dir):
+        self.archive_dir = os.path.join(data_dir, ARCHIVE_DIRNAME)
+        self.conn = self._connect(os.path.join(data_dir, DB_FILENAME))
+        self._archives = {}
+        self._lock = threading.Lock()
+        self._cache = {}
+        self._data_version = None
+
+    def _connect(self, path):
+        conn = sqlite3.connect(
+            f"file:{path}?mode=ro", uri=True, check_same_thread=False
+        )
+        conn.execute("PRAGMA query_only = 1")
+        return conn
+
+    # --- 本体DB → 新しい月のアーカイブの順に接続を返す（start以降の月のみ） ---
+    def _partitions(self, start=None):
+        conns = [self.conn]
+        for month in reversed(list_archive_months(self.archive_dir)):
+            if start is not None and month < start[:7]:
+                break
+            if month not in self._archives:
+                self._archives[month] = self._connect(
+                    archive_path(self.archive_dir, month)
+                )
+            conns.append(self._archives[month])
+        return conns
+
+    # --- クエリ実行（書き込み検知時にキャッシュを破棄） ---
+    # fetch は接続一覧を受け取り結果を返す関数（パーティションをまたぐ集計用）
+    def _query(self, key, sql=None, params=(), fetch=None, start=None):
+        with self._lock:
+            version = self.conn.execute("PRAGMA data_version").fetchone()[0]
+            if version != self._data_version or len(self._cache) > MAX_CACHE_ENTRIES:
+                self._cache.clear()
+                self._data_version = version
+            if key not in self._cache:
+                if fetch is None:
+                    self._cache[key] = self.conn.execute(sql, params).fetchall()
+                else:
+                    self._cache[key] = fetch(self._partitions(start))
+            return self._cache[key]
+
+    # --- 価格推移（points件を超える場合はNTILEで区間平均に間引く） ---
+    def prices(
+        self, symbol, start=None, end=None, points=DEFAULT_POINTS, source="daily"
+    ):
+        table, ts = (
+            ("short_term_price", "timestamp")
+            if source == "short"
+            else ("price_history", "date")
+        )
+        start = start or "0000-00-00"
+        end = end or "9999-99-99"
+        sql = f"""
+            SELECT MIN({ts}), MAX({ts}), AVG(CAST(price AS REAL)), COUNT(*)
+            FROM (
+                SELECT {ts}, price, NTILE(?) OVER (ORDER BY {ts}) AS bucket
+                FROM {table}
+                WHERE symbol = ? AND {ts} >= ? AND {ts} <= ?
+            )
+            GROUP BY bucket
+            ORDER BY bucket
+        """
+
+        # 短期価格はパーティションごとに件数に比例した区間数で間引いて連結する
+        def fetch(conns):
+            counts = [
+                c.execute(
+                    f"SELECT COUNT(*) FROM {table} "
+                    f"WHERE symbol = ? AND {ts} >= ? AND {ts} <= ?",
+                    (symbol, start, end),
+                ).fetchone()[0]
+                for c in conns
+            ]
+            total = sum(counts)
+            rows = []
+            for conn, count in reversed(list(zip(conns, counts))):
+                if count:
+                    buckets = max(1, round(points * count / total))
+                    rows += conn.execute(sql, (buckets, symbol, start, end)).fetchall()
+            return rows
+
+        if source == "short":
+            rows = self._query(
+                ("prices", symbol, start, end, points, source), fetch=fetch, start=start
+            )
+        else:
+            rows = self._query(
+                ("prices", symbol, start, end, points, source),
+                sql,
+                (points, symbol, start, end),
+            )
+        return [
+            {"from": r[0], "to": r[1], "price": r[2], "samples": r[3]} for r in rows
+        ]
+
+    def purchases(self, symbol=None, limit=100):
+        def fetch(conns):
+            rows = []
+            for conn in conns:
+                rows += conn.execute(
+                    """
+                    SELECT symbol, purchase_type, date, jpy_amount, crypto_amount,
+                        price, executed_price
+                    FROM purchase_history
+                    WHERE ? IS NULL OR symbol = ?
+                    ORDER BY date DESC LIMIT ?
+                    """,
+                    (symbol, symbol, limit - len(rows)),
+                ).fetchall()
+                if len(rows) >= limit:
+                    break
+            return rows
+
+        rows = self._query(("purchases", symbol, limit), fetch=fetch)
+        keys = (
+            "symbol",
+            "purchase_type",
+            "date",
+            "jpy_amount",
+            "crypto_amount",
+            "price",
+            "executed_price",
+        )
+        return [dict(zip(keys, r)) for r in rows]
+
+    # --- 通貨ごとの取得単価（総投資額 / 総数量） ---
+    def cost_basis(self):
+        # パーティションごとの合計を通貨単位で足し合わせる
+        def fetch(conns):
+            totals = {}
+            for conn in conns:
+                for symbol, count, jpy, crypto in conn.execute(
+                    """
+                    SELECT symbol, COUNT(*),
+                        SUM(CAST(jpy_amount AS REAL)),
+                        SUM(CAST(crypto_amount AS REAL))
+                    FROM purchase_history
+                    GROUP BY symbol
+                    """
+                ):
+                    t = totals.get(symbol, (0, 0.0, 0.0))
+                    totals[symbol] = (t[0] + count, t[1] + jpy, t[2] + crypto)
+            return [(s, *totals[s]) for s in sorted(totals)]
+
+        rows = self._query(("cost_basis",), fetch=fetch)
+        return [
+            {
+                "symbol": r[0],
+                "purchases": r[1],
+                "total_jpy": r[2],
+                "total_crypto": r[3],
+                "average_cost": r[2] / r[3] if r[3] else None,
+            }
+            for r in rows
+        ]
+
+    def alerts(self, limit=50):
+        rows = self._query(
+            ("alerts", limit),
+            """
+            SELECT symbol, alert_type, timestamp, change_percent, price
+            FROM alert_history
+            ORDER BY timestamp DESC LIMIT ?
+            """,
+            (limit,),
+        )
+        keys = ("symbol", "alert_type", "timestamp", "change_percent", "price")
+        return [dict(zip(keys, r)) for r in rows]
+
+
+CHART_PAGE = """<!DOCTYPE html>
+<html lang="ja"><head><meta charset="utf-8"><title>auto_invest</title>
+<style>body{font-family:sans-serif;margin:2em}svg{border:1px solid #ccc}</style>
+</head><body>
+<h1>価格推移</h1>
+<input id="symbol" value="BTC" size="6">
+<select id="source"><option value="daily">日次</option>
+<option value="short">短期</option></select>
+<button onclick="draw()">表示</button>
+<div><svg id="chart" width="900" height="300"></svg></div>
+<h2>取得単価</h2><pre id="cost"></pre>
+<script>
+async function draw() {
+  const symbol = document.getElementById("symbol").value.toUpperCase();
+  const source = document.getElementById("source").value;
+  const res = await fetch(`/api/prices?symbol=${symbol}&source=${source}&points=900`);
+  const data = await res.json();
+  const svg = document.getElementById("chart");
+  if (!data.length) { svg.innerHTML = ""; return; }
+  const ps = data.map(d => d.price);
+  const lo = Math.min(...ps), hi = Math.max(...ps), span = (hi - lo) || 1;
+  const pts = ps.map((p, i) =>
+    `${i * 900 / Math.max(ps.length - 1, 1)},${290 - (p - lo) / span * 280}`);
+  svg.innerHTML = `<polyline fill="none" stroke="#36c" points="${pts.join(" ")}"/>` +
+    `<text x="5" y="15">${hi.toFixed(2)}</text>` +
+    `<text x="5" y="295">${lo.toFixed(2)}</text>`;
+  const cost = await (await fetch("/api/cost-basis")).json();
+  document.getElementById("cost").textContent = JSON.stringify(cost, null, 2);
+}
+draw();
+</script></body></html>
+"""
+
+
+class DashboardHandler(BaseHTTPRequestHandler):
+    reader = None
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        try:
+            if url.path == "/":
+                return self._send(200, CHART_PAGE.encode("utf-8"), "text/html")
+            if url.path == "/api/prices":
+                if "symbol" not in query:
+                    return self._json(400, {"error": "symbol は必須です"})
+                points = min(int(query.get("points", DEFAULT_POINTS)), MAX_POINTS)
+                body = self.reader.prices(
+                    query["symbol"].upper(),
+                    start=query.get("from"),
+                    end=query.get("to"),
+                    points=max(points, 1),
+                    source=query.get("source", "daily"),
+                )
+            elif url.path == "/api/purchases":
+                symbol = query.get("symbol")
+                body = self.reader.purchases(
+                    symbol.upper() if symbol else None,
+                    limit=int(query.get("limit", 100)),
+                )
+            elif url.path == "/api/cost-basis":
+                body = self.reader.cost_basis()
+            elif url.path == "/api/alerts":
+                body = self.reader.alerts(limit=int(query.get("limit", 50)))
+            else:
+                return self._json(404, {"error": "not found"})
+        except ValueError as e:
+            return self._json(400, {"error": str(e)})
+        except sqlite3.Error as e:
+            logger.error(f"ダッシュボードのクエリ失敗: {e}")
+            return self._json(500, {"error": "database error"})
+        self._json(200, body)
+
+    def _json(self, status, body):
+        self._send(status, json.dumps(body, ensure_ascii=False).encode("utf-8"))
+
+    def _send(self, status, payload, content_type="application/json"):
+        self.send_response(status)
+        self.send_header("Content-Type", f"{content_type}; charset=utf-8")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        logger.debug(f"dashboard: {format % args}")
+
+
+# --- サーバー起動（Ctrl+Cで停止） ---
+def serve_dashboard(data_dir, host="127.0.0.1", port=8050):
+    DashboardHandler.reader = HistoryReader(data_dir)
+    server = ThreadingHTTPServer((host, port), DashboardHandler)
+    logger.info(f"ダッシュボードを起動しました: http://{host}:{port}/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
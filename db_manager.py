@@ -1,19 +1,107 @@
 # DB処理モジュール
 
 import os
+import time
+import shutil
 import sqlite3
 import datetime
 from decimal import Decimal
 import logging
+from fixed_point import parse_fixed, to_decimal, div_round
 
 logger = logging.getLogger(__name__)
 
 DB_FILENAME = "history.db"
+ARCHIVE_DIRNAME = "archive"
+
+# --- 月別アーカイブへ移す表と、月の判定に使う日時列 ---
+ARCHIVE_TABLES = {"short_term_price": "timestamp", "purchase_history": "date"}
+
+# --- 一括書き込みで行単位の失敗として扱う例外（それ以外はバッチ全体の失敗） ---
+ROW_ERRORS = (sqlite3.IntegrityError, sqlite3.InterfaceError, sqlite3.ProgrammingError)
+
+# --- 一括入出力で扱えるテーブルと列（purchase_historyのidは移行先で採番し直す） ---
+TABLE_COLUMNS = {
+    "price_history": (
+        "symbol",
+        "date",
+        "price",
+        "open",
+        "high",
+        "low",
+        "close",
+        "twap",
+        "samples",
+        "source",
+    ),
+    "short_term_price": ("symbol", "timestamp", "price"),
+    "purchase_history": (
+        "symbol",
+        "purchase_type",
+        "date",
+        "jpy_amount",
+        "crypto_amount",
+        "price",
+        "executed_price",
+        "executed_time",
+        "order_group",
+        "slice_index",
+        "slippage_percent",
+        "order_slippage_percent",
+    ),
+}
+
+# --- 既存DBに後から追加した列（ALTER TABLEで補う） ---
+ADDED_COLUMNS = {
+    "price_history": (
+        ("open", "TEXT"),
+        ("high", "TEXT"),
+        ("low", "TEXT"),
+        ("close", "TEXT"),
+        ("twap", "TEXT"),
+        ("samples", "INTEGER"),
+        ("source", "TEXT"),
+    ),
+    "purchase_history": (
+        ("order_group", "TEXT"),
+        ("slice_index", "INTEGER"),
+        ("slippage_percent", "TEXT"),
+        ("order_slippage_percent", "TEXT"),
+    ),
+}
+
+
+# --- 月別アーカイブのパスと一覧（YYYY-MM の昇順） ---
+def archive_path(archive_dir, month):
+    return os.path.join(archive_dir, f"history-{month}.db")
+
+
+def list_archive_months(archive_dir):
+    if not os.path.isdir(archive_dir):
+        return []
+    return sorted(
+        name[len("history-") : -len(".db")]
+        for name in os.listdir(archive_dir)
+        if name.startswith("history-") and name.endswith(".db")
+    )
+
+
+# --- 後から追加した列を既存の表に補う ---
+def _add_missing_columns(cur):
+    for table, columns in ADDED_COLUMNS.items():
+        cur.execute(f"PRAGMA table_info({table})")
+        existing = {r[1] for r in cur.fetchall()}
+        if not existing:
+            continue
+        for name, col_type in columns:
+            if name not in existing:
+                cur.execute(f"ALTER TABLE {table} ADD COLUMN {name} {col_type}")
 
 
 class DBManager:
     def __init__(self, data_dir):
         self.db_path = os.path.join(data_dir, DB_FILENAME)
+        self.archive_dir = os.path.join(data_dir, ARCHIVE_DIRNAME)
 
     # --- DB初期化 ---
     def ensure_initialized(self):
@@ -22,6 +110,9 @@ class DBManager:
             conn = sqlite3.connect(self.db_path)
             cur = conn.cursor()
 
+            # WALモード: 読み取り（ダッシュボード等）が書き込みをブロックしない
+            cur.execute("PRAGMA journal_mode=WAL")
+
             cur.execute(
                 """
                 CREATE TABLE IF NOT EXISTS price_history (
@@ -49,6 +140,8 @@ class DBManager:
             """
             )
 
+            _add_missing_columns(cur)
+
             cur.execute(
                 """
                 CREATE TABLE IF NOT EXISTS short_term_price (
@@ -60,6 +153,56 @@ class DBManager:
                 """
             )
 
+            cur.execute(
+                """
+                CREATE TABLE IF NOT EXISTS alert_history (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    symbol TEXT NOT NULL,
+                    alert_type TEXT NOT NULL,
+                    timestamp TEXT NOT NULL,
+                    change_percent TEXT NOT NULL,
+                    price TEXT NOT NULL
+                )
+                """
+            )
+
+            cur.execute(
+                """
+                CREATE TABLE IF NOT EXISTS run_lease (
+                    mode TEXT PRIMARY KEY,
+                    owner TEXT NOT NULL,
+                    acquired_at REAL NOT NULL,
+                    heartbeat_at REAL NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+                """
+            )
+
+            cur.execute(
+                """
+                CREATE TABLE IF NOT EXISTS purchase_key (
+                    key TEXT PRIMARY KEY,
+                    symbol TEXT NOT NULL,
+                    purchase_type TEXT NOT NULL,
+                    scheduled_date TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    owner TEXT NOT NULL,
+                    created_at TEXT NOT NULL,
+                    updated_at TEXT NOT NULL
+                )
+                """
+            )
+
+            cur.execute(
+                """
+                CREATE TABLE IF NOT EXISTS account_snapshot (
+                    id INTEGER PRIMARY KEY CHECK (id = 1),
+                    fetched_at REAL NOT NULL,
+                    assets TEXT NOT NULL
+                )
+                """
+            )
+
             conn.commit()
         except Exception as e:
             handle_db_error(e, context="DB初期化処理")
@@ -69,21 +212,197 @@ class DBManager:
 
     # --- 指定通貨の評価額推移を記録する ---
     def record_price_history(self, symbol, current_price, date=None):
-        date_str = date or datetime.datetime.now().strftime("%Y-%m-%d")
+        self.record_price_histories([(symbol, current_price, date)])
+
+    # --- 日次価格を一括記録する（行: (通貨, 価格, 日付 or None)） ---
+    def record_price_histories(self, rows):
+        today = datetime.datetime.now().strftime("%Y-%m-%d")
+        return self._write_many(
+            """
+            INSERT OR REPLACE INTO price_history (symbol, date, price)
+            VALUES (?, ?, ?)
+            """,
+            rows,
+            lambda r: (r[0], r[2] or today, str(r[1])),
+            context="評価額推移記録処理",
+        )
+
+    # --- 短期価格から日次の始値・高値・安値・終値・時間加重平均を集計して記録する ---
+    # 通貨ごとに前回集計した日の翌日（未集計なら最新の日次価格の日）から
+    # until_date の前日までを1回のクエリで読み出し、固定小数点で集計して
+    # 1トランザクションで書き込む。サンプル数・カバー時間が足りない日は記録しない。
+    # price列には price_field（close / twap）の値を使う。
+    def aggregate_daily_prices(
+        self,
+        symbols,
+        until_date,
+        price_field="twap",
+        min_samples=1,
+        min_coverage_hours=0,
+        max_days=37,
+    ):
+        if not symbols:
+            return []
+        placeholders = ", ".join("?" for _ in symbols)
         conn = None
         try:
             conn = sqlite3.connect(self.db_path)
             cur = conn.cursor()
+            # 各サンプルの重みは次のサンプルまでの秒数（最後のサンプルは日末まで）
             cur.execute(
+                f"""
+                WITH samples AS (
+                    SELECT s.symbol, substr(s.timestamp, 1, 10) AS day,
+                        s.timestamp, s.price
+                    FROM short_term_price s
+                    WHERE s.symbol IN ({placeholders}) AND s.timestamp < ?
+                        AND s.timestamp >= MAX(
+                            date(?, '-' || ? || ' days'),
+                            COALESCE(
+                                (
+                                    SELECT date(MAX(h.date), '+1 day')
+                                    FROM price_history h
+                                    WHERE h.symbol = s.symbol
+                                        AND h.source = 'intraday'
+                                ),
+                                (
+                                    SELECT MAX(h.date) FROM price_history h
+                                    WHERE h.symbol = s.symbol
+                                ),
+                                ''
+                            )
+                        )
+                )
+                SELECT symbol, day, timestamp, price,
+                    CAST(ROUND((
+                        COALESCE(
+                            julianday(LEAD(timestamp) OVER (
+                                PARTITION BY symbol, day ORDER BY timestamp
+                            )),
+                            julianday(day, '+1 day')
+                        ) - julianday(timestamp)
+                    ) * 86400) AS INTEGER) AS dt
+                FROM samples
+                ORDER BY symbol, day, timestamp
+                """,
+                (*symbols, until_date, until_date, max_days),
+            )
+            days = {}
+            for symbol, day, timestamp, price, dt in cur.fetchall():
+                days.setdefault((symbol, day), []).append(
+                    (timestamp, price, parse_fixed(price), dt)
+                )
+
+            rows = []
+            for (symbol, day), samples in days.items():
+                first, last = samples[0][0], samples[-1][0]
+                coverage = datetime.datetime.fromisoformat(
+                    last
+                ) - datetime.datetime.fromisoformat(first)
+                total = sum(dt for _, _, _, dt in samples)
+                if (
+                    len(samples) < min_samples
+                    or coverage.total_seconds() < min_coverage_hours * 3600
+                    or total <= 0
+                ):
+                    logger.info(
+                        f"{symbol} {day} の短期価格が不足しているため日次集計しません"
+                        f"（{len(samples)}件 / {first[11:16]}〜{last[11:16]}）"
+                    )
+                    continue
+                open_, close = samples[0][1], samples[-1][1]
+                high = max(samples, key=lambda x: x[2])[1]
+                low = min(samples, key=lambda x: x[2])[1]
+                weighted = sum(fx * dt for _, _, fx, dt in samples)
+                twap = format(to_decimal(div_round(weighted, total)).normalize(), "f")
+                price = close if price_field == "close" else twap
+                rows.append(
+                    (symbol, day, price, open_, high, low, close, twap, len(samples))
+                )
+
+            cur.executemany(
                 """
-                INSERT OR REPLACE INTO price_history (symbol, date, price)
-                VALUES (?, ?, ?)
-            """,
-                (symbol, date_str, str(current_price)),
+                INSERT OR REPLACE INTO price_history (
+                    symbol, date, price, open, high, low, close, twap, samples, source
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 'intraday')
+                """,
+                rows,
             )
             conn.commit()
+            return [(r[0], r[1]) for r in rows]
+        except Exception as e:
+            if conn:
+                conn.rollback()
+            handle_db_error(e, context="日次価格集計処理")
+            return []
+        finally:
+            if conn:
+                conn.close()
+
+    # --- 指定日に短期価格から集計済みの通貨 ---
+    def get_aggregated_symbols(self, date):
+        conn = None
+        try:
+            conn = sqlite3.connect(self.db_path)
+            cur = conn.cursor()
+            cur.execute(
+                """
+                SELECT symbol FROM price_history
+                WHERE date = ? AND source = 'intraday'
+                """,
+                (date,),
+            )
+            return {r[0] for r in cur.fetchall()}
         except Exception as e:
-            handle_db_error(e, context="評価額推移記録処理")
+            handle_db_error(e, context="日次価格集計状況取得処理")
+            return set()
+        finally:
+            if conn:
+                conn.close()
+
+    # --- 価格履歴の欠損日を連続区間にまとめて取得する ---
+    def find_price_history_gaps(self, symbols, start_date, end_date):
+        if not symbols:
+            return []
+        values = ", ".join("(?)" for _ in symbols)
+        conn = None
+        try:
+            conn = sqlite3.connect(self.db_path)
+            cur = conn.cursor()
+            # 暦日CTE × 通貨から欠損日を抽出し、日付-連番で連続区間をグループ化する
+            cur.execute(
+                f"""
+                WITH RECURSIVE calendar(d) AS (
+                    SELECT date(?)
+                    UNION ALL
+                    SELECT date(d, '+1 day') FROM calendar WHERE d < date(?)
+                ),
+                symbols(symbol) AS (VALUES {values}),
+                missing AS (
+                    SELECT s.symbol, c.d
+                    FROM symbols s CROSS JOIN calendar c
+                    WHERE NOT EXISTS (
+                        SELECT 1 FROM price_history p
+                        WHERE p.symbol = s.symbol AND p.date = c.d
+                    )
+                ),
+                grouped AS (
+                    SELECT symbol, d,
+                        julianday(d) - ROW_NUMBER() OVER (
+                            PARTITION BY symbol ORDER BY d
+                        ) AS grp
+                    FROM missing
+                )
+                SELECT symbol, MIN(d), MAX(d) FROM grouped
+                GROUP BY symbol, grp
+                ORDER BY symbol, MIN(d)
+                """,
+                (start_date, end_date, *symbols),
+            )
+            return cur.fetchall()
+        except Exception as e:
+            handle_db_error(e, context="価格履歴欠損検出処理")
+            return []
         finally:
             if conn:
                 conn.close()
@@ -110,26 +429,56 @@ class DBManager:
             if conn:
                 conn.close()
 
-    def record_short_term_price(self, symbol, price, timestamp=None):
-        timestamp = timestamp or datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    # --- 複数通貨の直近days件の終値を1回のクエリで取得 ---
+    def get_price_series_bulk(self, symbols, days):
+        if not symbols or days <= 0:
+            return {}
+        placeholders = ", ".join("?" for _ in symbols)
         conn = None
         try:
             conn = sqlite3.connect(self.db_path)
             cur = conn.cursor()
             cur.execute(
-                """
-                INSERT OR REPLACE INTO short_term_price (symbol, timestamp, price)
-                VALUES (?, ?, ?)
+                f"""
+                SELECT symbol, date, price FROM (
+                    SELECT symbol, date, price, ROW_NUMBER() OVER (
+                        PARTITION BY symbol ORDER BY date DESC
+                    ) AS rn
+                    FROM price_history
+                    WHERE symbol IN ({placeholders})
+                )
+                WHERE rn <= ?
+                ORDER BY symbol, date
                 """,
-                (symbol, timestamp, str(price)),
+                (*symbols, days),
             )
-            conn.commit()
+            result = {}
+            for symbol, date, price in cur.fetchall():
+                result.setdefault(symbol, []).append((date, parse_fixed(price)))
+            return result
         except Exception as e:
-            handle_db_error(e, context="短期価格記録処理")
+            handle_db_error(e, context="評価額推移一括取得処理")
+            return {}
         finally:
             if conn:
                 conn.close()
 
+    def record_short_term_price(self, symbol, price, timestamp=None):
+        self.record_short_term_prices([(symbol, price, timestamp)])
+
+    # --- 短期価格を一括記録する（行: (通貨, 価格, 日時 or None)） ---
+    def record_short_term_prices(self, rows):
+        now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        return self._write_many(
+            """
+            INSERT OR REPLACE INTO short_term_price (symbol, timestamp, price)
+            VALUES (?, ?, ?)
+            """,
+            rows,
+            lambda r: (r[0], r[2] or now, str(r[1])),
+            context="短期価格記録処理",
+        )
+
     # --- 指定通貨の購入履歴を記録する ---
     def record_purchase_history(
         self,
@@ -140,52 +489,159 @@ class DBManager:
         current_price,
         executed_price=None,
         executed_time=None,
+        order_group=None,
+        slice_index=None,
+        slippage_percent=None,
+        order_slippage_percent=None,
     ):
-        date = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        self.record_purchase_histories(
+            [
+                {
+                    "symbol": symbol,
+                    "jpy_amount": jpy_amount,
+                    "crypto_amount": crypto_amount,
+                    "purchase_type": purchase_type,
+                    "current_price": current_price,
+                    "executed_price": executed_price,
+                    "executed_time": executed_time,
+                    "order_group": order_group,
+                    "slice_index": slice_index,
+                    "slippage_percent": slippage_percent,
+                    "order_slippage_percent": order_slippage_percent,
+                }
+            ]
+        )
+
+    # --- 購入履歴を一括記録する（行: record_purchase_history の引数の辞書） ---
+    def record_purchase_histories(self, rows):
+        now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        return self._write_many(
+            """
+            INSERT INTO purchase_history (
+                symbol,
+                purchase_type,
+                date,
+                jpy_amount,
+                crypto_amount,
+                price,
+                executed_price,
+                executed_time,
+                order_group,
+                slice_index,
+                slippage_percent,
+                order_slippage_percent
+            )VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            rows,
+            lambda r: (
+                r["symbol"],
+                r["purchase_type"],
+                r.get("date") or now,
+                str(r["jpy_amount"]),
+                str(r["crypto_amount"]),
+                str(r["current_price"]),
+                str(r.get("executed_price")),
+                str(r.get("executed_time")),
+                r.get("order_group"),
+                r.get("slice_index"),
+                _str_or_none(r.get("slippage_percent")),
+                _str_or_none(r.get("order_slippage_percent")),
+            ),
+            context="購入履歴記録処理",
+        )
+
+    # --- 分割注文全体のスリッページを各スライスに記録する ---
+    def update_order_slippage(self, order_group, order_slippage_percent):
         conn = None
         try:
             conn = sqlite3.connect(self.db_path)
             cur = conn.cursor()
             cur.execute(
                 """
-                INSERT INTO purchase_history (
-                    symbol,
-                    purchase_type,
-                    date,
-                    jpy_amount,
-                    crypto_amount,
-                    price,
-                    executed_price,
-                    executed_time
-                )VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                UPDATE purchase_history SET order_slippage_percent = ?
+                WHERE order_group = ?
                 """,
-                (
-                    symbol,
-                    purchase_type,
-                    date,
-                    str(jpy_amount),
-                    str(crypto_amount),
-                    str(current_price),
-                    str(executed_price),
-                    str(executed_time),
-                ),
+                (_str_or_none(order_slippage_percent), order_group),
             )
             conn.commit()
         except Exception as e:
-            handle_db_error(e, context="購入履歴記録処理")
+            handle_db_error(e, context="注文スリッページ記録処理")
+        finally:
+            if conn:
+                conn.close()
+
+    # --- 急騰・急落アラートを記録する ---
+    def record_alert(self, symbol, alert_type, change_percent, price):
+        self.record_alerts([(symbol, alert_type, change_percent, price)])
+
+    # --- アラートを一括記録する（行: (通貨, 種別, 変化率, 価格)） ---
+    def record_alerts(self, rows):
+        now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        return self._write_many(
+            """
+            INSERT INTO alert_history
+                (symbol, alert_type, timestamp, change_percent, price)
+            VALUES (?, ?, ?, ?, ?)
+            """,
+            rows,
+            lambda r: (r[0], r[1], now, str(r[2]), str(r[3])),
+            context="アラート履歴記録処理",
+        )
+
+    # --- 複数行を1トランザクション（コミット1回）で書き込む ---
+    # 戻り値は入力行ごとのエラー内容（成功はNone）。
+    # 一括書き込みが行の制約違反などで失敗した場合は、セーブポイントで1行ずつ
+    # 書き直して失敗した行だけを除外する（いずれも同じトランザクション内）。
+    def _write_many(self, query, rows, to_params, context):
+        rows = list(rows)
+        results = [None] * len(rows)
+        params = []
+        for i, row in enumerate(rows):
+            try:
+                params.append((i, to_params(row)))
+            except (KeyError, IndexError, TypeError) as e:
+                results[i] = f"不正な行: {e!r}"
+        if not params:
+            self._log_row_errors(rows, results, context)
+            return results
+
+        conn = None
+        try:
+            conn = sqlite3.connect(self.db_path)
+            try:
+                with conn:
+                    conn.executemany(query, [p for _, p in params])
+            except ROW_ERRORS:
+                conn.execute("BEGIN")
+                for i, p in params:
+                    conn.execute("SAVEPOINT write_row")
+                    try:
+                        conn.execute(query, p)
+                    except ROW_ERRORS as e:
+                        conn.execute("ROLLBACK TO write_row")
+                        results[i] = str(e)
+                    conn.execute("RELEASE write_row")
+                conn.commit()
+        except Exception as e:
+            handle_db_error(e, context=context)
+            return [r or str(e) for r in results]
         finally:
             if conn:
                 conn.close()
 
+        self._log_row_errors(rows, results, context)
+        return results
+
+    def _log_row_errors(self, rows, results, context):
+        for row, error in zip(rows, results):
+            if error:
+                logger.error(f"DBエラー（{context}）: {error} - {row}")
+
     # --- 指定通貨の購入履歴を取得する ---
     def get_purchase_history(
         self, symbol, limit=30, before_date=None, purchase_type=None
     ):
-        conn = None
         try:
-            conn = sqlite3.connect(self.db_path)
-            cur = conn.cursor()
-
             query = """
                 SELECT date, crypto_amount, jpy_amount, price
                 FROM purchase_history
@@ -202,24 +658,49 @@ class DBManager:
                 params.append(before_date)
 
             query += " ORDER BY date DESC LIMIT ?"
-            params.append(limit)
-
-            cur.execute(query, params)
-            return cur.fetchall()
+            return self._fetch_recent(query, params, limit, before=before_date)
         except Exception as e:
             handle_db_error(e, context="購入履歴取得処理")
             return []
-        finally:
-            if conn:
-                conn.close()
+
+    # --- 複数通貨の指定日より前の最新購入価格を取得 ---
+    def get_last_purchase_prices(self, symbols, before_date):
+        if not symbols:
+            return {}
+        result = {}
+        try:
+            # 本体DBで見つからない通貨のみ、新しい月のアーカイブから順に探す
+            for path, archived in self._partitions(before=before_date):
+                missing = [s for s in symbols if s not in result]
+                if not missing:
+                    break
+                placeholders = ", ".join("?" for _ in missing)
+                conn = self._connect_partition(path, archived)
+                try:
+                    rows = conn.execute(
+                        f"""
+                        SELECT symbol, price FROM (
+                            SELECT symbol, price, ROW_NUMBER() OVER (
+                                PARTITION BY symbol ORDER BY date DESC
+                            ) AS rn
+                            FROM purchase_history
+                            WHERE symbol IN ({placeholders}) AND date < ?
+                        )
+                        WHERE rn = 1
+                        """,
+                        (*missing, before_date),
+                    ).fetchall()
+                finally:
+                    conn.close()
+                result.update(rows)
+            return result
+        except Exception as e:
+            handle_db_error(e, context="前回購入価格取得処理")
+            return result
 
     # --- 最新の購入レコードを取得 ---
     def get_last_purchase(self, symbol, purchase_type=None):
-        conn = None
         try:
-            conn = sqlite3.connect(self.db_path)
-            cur = conn.cursor()
-
             query = """
                 SELECT date, crypto_amount, jpy_amount, price
                 FROM purchase_history
@@ -231,40 +712,540 @@ class DBManager:
                 query += " AND purchase_type = ?"
                 params.append(purchase_type)
 
-            query += " ORDER BY date DESC LIMIT 1"
-
-            cur.execute(query, params)
-            return cur.fetchone()
+            query += " ORDER BY date DESC LIMIT ?"
+            rows = self._fetch_recent(query, params, 1)
+            return rows[0] if rows else None
         except Exception as e:
             handle_db_error(e, context="最新購入取得処理")
             return None
-        finally:
-            if conn:
-                conn.close()
 
     # --- 最新の短期価格レコードを取得 ---
     def get_latest_short_term_prices(self, symbol, limit=2):
-        conn = None
         try:
-            conn = sqlite3.connect(self.db_path)
-            cur = conn.cursor()
-            cur.execute(
+            rows = self._fetch_recent(
                 """
                 SELECT timestamp, price FROM short_term_price
                 WHERE symbol = ?
                 ORDER BY timestamp DESC LIMIT ?
                 """,
-                (symbol, limit),
+                [symbol],
+                limit,
             )
-            rows = cur.fetchall()
             return [(r[0], Decimal(r[1])) for r in reversed(rows)]
         except Exception as e:
             handle_db_error(e, context="短期価格（最新）取得処理")
             return []
+
+    # --- 複数通貨の since 以降で最新の短期価格を1回のクエリで取得 ---
+    def get_latest_short_term_price_map(self, symbols, since):
+        if not symbols:
+            return {}
+        placeholders = ", ".join("?" for _ in symbols)
+        conn = None
+        try:
+            conn = sqlite3.connect(self.db_path)
+            cur = conn.cursor()
+            cur.execute(
+                f"""
+                SELECT symbol, price FROM (
+                    SELECT symbol, price, ROW_NUMBER() OVER (
+                        PARTITION BY symbol ORDER BY timestamp DESC
+                    ) AS rn
+                    FROM short_term_price
+                    WHERE symbol IN ({placeholders}) AND timestamp >= ?
+                )
+                WHERE rn = 1
+                """,
+                (*symbols, since),
+            )
+            return {symbol: Decimal(price) for symbol, price in cur.fetchall()}
+        except Exception as e:
+            handle_db_error(e, context="短期価格（最新）一括取得処理")
+            return {}
+        finally:
+            if conn:
+                conn.close()
+
+    # --- 短期価格から足（ローソク足の終値）を作り、指標を全通貨まとめて計算する ---
+    def get_intraday_indicators(self, symbols, interval_minutes, period, since):
+        if not symbols:
+            return {}
+        placeholders = ", ".join("?" for _ in symbols)
+        frame = int(period) - 1
+        conn = None
+        try:
+            conn = sqlite3.connect(self.db_path)
+            cur = conn.cursor()
+            cur.execute(
+                f"""
+                WITH samples AS (
+                    SELECT symbol, timestamp, CAST(price AS REAL) AS price,
+                        CAST(strftime('%s', timestamp) AS INTEGER) / ? AS bucket
+                    FROM short_term_price
+                    WHERE symbol IN ({placeholders}) AND timestamp >= ?
+                ),
+                closes AS (
+                    SELECT symbol, bucket, price AS close FROM (
+                        SELECT symbol, bucket, price, ROW_NUMBER() OVER (
+                            PARTITION BY symbol, bucket ORDER BY timestamp DESC
+                        ) AS rn
+                        FROM samples
+                    )
+                    WHERE rn = 1
+                ),
+                diffs AS (
+                    SELECT symbol, bucket, close,
+                        close - LAG(close) OVER (
+                            PARTITION BY symbol ORDER BY bucket
+                        ) AS diff,
+                        ROW_NUMBER() OVER (
+                            PARTITION BY symbol ORDER BY bucket DESC
+                        ) AS recency
+                    FROM closes
+                ),
+                stats AS (
+                    SELECT symbol, close, recency,
+                        COUNT(*) OVER win AS candles,
+                        COUNT(diff) OVER win AS moves,
+                        AVG(close) OVER win AS sma,
+                        AVG(close * close) OVER win AS mean_sq,
+                        SUM(MAX(diff, 0)) OVER win AS gain,
+                        SUM(MAX(-diff, 0)) OVER win AS loss
+                    FROM diffs
+                    WINDOW win AS (
+                        PARTITION BY symbol ORDER BY bucket
+                        ROWS BETWEEN {frame} PRECEDING AND CURRENT ROW
+                    )
+                )
+                SELECT symbol, close, candles, moves, sma,
+                    mean_sq - sma * sma AS variance,
+                    CASE
+                        WHEN loss = 0 THEN 100.0
+                        ELSE 100.0 - 100.0 / (1.0 + gain / loss)
+                    END AS rsi
+                FROM stats
+                WHERE recency = 1
+                """,
+                (int(interval_minutes) * 60, *symbols, since),
+            )
+            return {
+                r[0]: {
+                    "close": r[1],
+                    "candles": r[2],
+                    "moves": r[3],
+                    "sma": r[4],
+                    "variance": r[5],
+                    "rsi": r[6],
+                }
+                for r in cur.fetchall()
+            }
+        except Exception as e:
+            handle_db_error(e, context="短期指標計算処理")
+            return {}
         finally:
             if conn:
                 conn.close()
 
+    # --- 実行リースの取得（期限切れ、または自身のリースのみ奪取できる） ---
+    def acquire_lease(self, mode, owner, ttl):
+        now = time.time()
+        conn = None
+        try:
+            conn = sqlite3.connect(self.db_path, timeout=ttl)
+            cur = conn.cursor()
+            cur.execute(
+                """
+                INSERT INTO run_lease
+                    (mode, owner, acquired_at, heartbeat_at, expires_at)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(mode) DO UPDATE SET
+                    owner = excluded.owner,
+                    acquired_at = excluded.acquired_at,
+                    heartbeat_at = excluded.heartbeat_at,
+                    expires_at = excluded.expires_at
+                WHERE run_lease.expires_at < excluded.heartbeat_at
+                    OR run_lease.owner = excluded.owner
+                """,
+                (mode, owner, now, now, now + ttl),
+            )
+            conn.commit()
+            return cur.rowcount == 1
+        except Exception as e:
+            handle_db_error(e, context="実行リース取得処理")
+            return False
+        finally:
+            if conn:
+                conn.close()
+
+    # --- 実行リースの延長（ハートビート） ---
+    def renew_lease(self, mode, owner, ttl):
+        now = time.time()
+        conn = None
+        try:
+            conn = sqlite3.connect(self.db_path)
+            cur = conn.cursor()
+            cur.execute(
+                """
+                UPDATE run_lease SET heartbeat_at = ?, expires_at = ?
+                WHERE mode = ? AND owner = ?
+                """,
+                (now, now + ttl, mode, owner),
+            )
+            conn.commit()
+            return cur.rowcount == 1
+        except Exception as e:
+            handle_db_error(e, context="実行リース延長処理")
+            return False
+        finally:
+            if conn:
+                conn.close()
+
+    def release_lease(self, mode, owner):
+        conn = None
+        try:
+            conn = sqlite3.connect(self.db_path)
+            cur = conn.cursor()
+            cur.execute(
+                "DELETE FROM run_lease WHERE mode = ? AND owner = ?", (mode, owner)
+            )
+            conn.commit()
+        except Exception as e:
+            handle_db_error(e, context="実行リース解放処理")
+        finally:
+            if conn:
+                conn.close()
+
+    # --- 口座資産スナップショット（1行のみ保持） ---
+    def save_account_snapshot(self, fetched_at, assets_json):
+        conn = None
+        try:
+            conn = sqlite3.connect(self.db_path)
+            cur = conn.cursor()
+            cur.execute(
+                """
+                INSERT OR REPLACE INTO account_snapshot (id, fetched_at, assets)
+                VALUES (1, ?, ?)
+                """,
+                (fetched_at, assets_json),
+            )
+            conn.commit()
+        except Exception as e:
+            handle_db_error(e, context="口座資産スナップショット保存処理")
+        finally:
+            if conn:
+                conn.close()
+
+    def get_account_snapshot(self):
+        conn = None
+        try:
+            conn = sqlite3.connect(self.db_path)
+            cur = conn.cursor()
+            cur.execute("SELECT fetched_at, assets FROM account_snapshot WHERE id = 1")
+            return cur.fetchone()
+        except Exception as e:
+            handle_db_error(e, context="口座資産スナップショット取得処理")
+            return None
+        finally:
+            if conn:
+                conn.close()
+
+    # --- 注文前の冪等キー予約（失敗済みのキーのみ再予約できる） ---
+    def reserve_purchase_key(self, symbol, purchase_type, scheduled_date, owner):
+        key = f"{symbol}:{purchase_type}:{scheduled_date}"
+        now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        conn = None
+        try:
+            conn = sqlite3.connect(self.db_path)
+            cur = conn.cursor()
+            cur.execute(
+                """
+                INSERT INTO purchase_key (
+                    key, symbol, purchase_type, scheduled_date,
+                    status, owner, created_at, updated_at
+                ) VALUES (?, ?, ?, ?, 'pending', ?, ?, ?)
+                ON CONFLICT(key) DO UPDATE SET
+                    status = 'pending',
+                    owner = excluded.owner,
+                    updated_at = excluded.updated_at
+                WHERE purchase_key.status = 'failed'
+                """,
+                (key, symbol, purchase_type, scheduled_date, owner, now, now),
+            )
+            conn.commit()
+            return key if cur.rowcount == 1 else None
+        except Exception as e:
+            handle_db_error(e, context="購入キー予約処理")
+            return None
+        finally:
+            if conn:
+                conn.close()
+
+    # --- 冪等キーの状態更新（done / failed） ---
+    def complete_purchase_key(self, key, status):
+        now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        conn = None
+        try:
+            conn = sqlite3.connect(self.db_path)
+            cur = conn.cursor()
+            cur.execute(
+                "UPDATE purchase_key SET status = ?, updated_at = ? WHERE key = ?",
+                (status, now, key),
+            )
+            conn.commit()
+        except Exception as e:
+            handle_db_error(e, context="購入キー更新処理")
+        finally:
+            if conn:
+                conn.close()
+
+    # --- テーブルを一貫したスナップショットとして逐次読み出す ---
+    def stream_table(self, table, columns, on_start, on_batch, batch_size=5000):
+        self._check_columns(table, columns)
+        col_sql = ", ".join(columns)
+        width_sql = ", ".join(f"COALESCE(MAX(LENGTH({c})), 0)" for c in columns)
+        # アーカイブ対象の表は古い月のアーカイブ → 本体DBの順に読み出す
+        if table in ARCHIVE_TABLES:
+            partitions = list(reversed(self._partitions()))
+        else:
+            partitions = [(self.db_path, False)]
+        conns = []
+        try:
+            for path, archived in partitions:
+                conns.append(
+                    self._connect_partition(path, archived, isolation_level=None)
+                )
+            # 件数・列幅の取得と読み出しを同一の読み取りトランザクションで行う
+            total = 0
+            widths = [0] * len(columns)
+            for conn in conns:
+                conn.execute("BEGIN")
+                row = conn.execute(
+                    f"SELECT COUNT(*), {width_sql} FROM {table}"
+                ).fetchone()
+                total += row[0]
+                widths = [max(w, v) for w, v in zip(widths, row[1:])]
+            on_start(total, widths)
+
+            for conn in conns:
+                cur = conn.execute(f"SELECT {col_sql} FROM {table} ORDER BY rowid")
+                while True:
+                    rows = cur.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    on_batch(rows)
+                conn.execute("COMMIT")
+            return True
+        except Exception as e:
+            handle_db_error(e, context=f"{table} 一括読み出し処理")
+            return False
+        finally:
+            for conn in conns:
+                conn.close()
+
+    # --- バッチ単位のトランザクションで行を一括投入する（戻り値: 件数, 成否） ---
+    def import_rows(self, table, columns, batches):
+        self._check_columns(table, columns)
+        placeholders = ", ".join("?" for _ in columns)
+        col_sql = ", ".join(columns)
+        if table == "purchase_history":
+            # idを持たないため、同一の購入（通貨・種別・日時）は重複投入しない
+            query = f"""
+                INSERT INTO purchase_history ({col_sql})
+                SELECT {placeholders}
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM purchase_history
+                    WHERE symbol = ? AND purchase_type = ? AND date = ?
+                )
+            """
+            idx = [columns.index(c) for c in ("symbol", "purchase_type", "date")]
+        else:
+            query = (
+                f"INSERT OR REPLACE INTO {table} ({col_sql}) VALUES ({placeholders})"
+            )
+            idx = []
+
+        inserted = 0
+        conn = None
+        try:
+            conn = sqlite3.connect(self.db_path)
+            for rows in batches:
+                params = [tuple(r) + tuple(r[i] for i in idx) for r in rows]
+                with conn:
+                    before = conn.total_changes
+                    conn.executemany(query, params)
+                    inserted += conn.total_changes - before
+            return inserted, True
+        except Exception as e:
+            handle_db_error(e, context=f"{table} 一括投入処理")
+            return inserted, False
+        finally:
+            if conn:
+                conn.close()
+
+    # --- パーティション（本体DB → 新しい月のアーカイブから順、before以前の月のみ） ---
+    def _partitions(self, before=None):
+        partitions = [(self.db_path, False)]
+        for month in reversed(list_archive_months(self.archive_dir)):
+            if before is None or month <= before[:7]:
+                partitions.append((archive_path(self.archive_dir, month), True))
+        return partitions
+
+    def _connect_partition(self, path, archived, **kwargs):
+        if archived:
+            return sqlite3.connect(f"file:{path}?mode=ro", uri=True, **kwargs)
+        return sqlite3.connect(path, **kwargs)
+
+    # --- 新しい順に並べて LIMIT ? で終わるクエリを、件数が揃うまでパーティションをまたいで実行 ---
+    # アーカイブは本体DBより古い月の行のみを持つため、順に連結すれば新しい順が保たれる
+    def _fetch_recent(self, query, params, limit, before=None):
+        rows = []
+        for path, archived in self._partitions(before):
+            conn = self._connect_partition(path, archived)
+            try:
+                rows += conn.execute(query, (*params, limit - len(rows))).fetchall()
+            finally:
+                conn.close()
+            if len(rows) >= limit:
+                break
+        return rows
+
+    # --- hot_days より前の月の短期価格・購入履歴を月別アーカイブへ移す ---
+    def archive_old_rows(self, hot_days):
+        cutoff = datetime.date.today() - datetime.timedelta(days=hot_days)
+        cutoff_month = cutoff.strftime("%Y-%m")
+        moved = {}
+        conn = None
+        try:
+            conn = sqlite3.connect(self.db_path)
+            cur = conn.cursor()
+            months = set()
+            for table, ts in ARCHIVE_TABLES.items():
+                cur.execute(
+                    f"SELECT DISTINCT substr({ts}, 1, 7) FROM {table} WHERE {ts} < ?",
+                    (cutoff_month,),
+                )
+                months |= {r[0] for r in cur.fetchall()}
+            if not months:
+                return moved
+
+            cur.execute(
+                """
+                SELECT name, sql FROM sqlite_master
+                WHERE type = 'table' AND name IN (?, ?)
+                """,
+                tuple(ARCHIVE_TABLES),
+            )
+            schemas = dict(cur.fetchall())
+            os.makedirs(self.archive_dir, exist_ok=True)
+
+            for month in sorted(months):
+                path = archive_path(self.archive_dir, month)
+                self._ensure_archive(path, schemas)
+                cur.execute("ATTACH DATABASE ? AS archive", (path,))
+                try:
+                    # 月ごとにコピーと削除を1トランザクションで行う（再実行しても重複しない）
+                    with conn:
+                        for table, ts in ARCHIVE_TABLES.items():
+                            count = self._move_month(cur, table, ts, month)
+                            if count:
+                                moved[(month, table)] = count
+                finally:
+                    cur.execute("DETACH DATABASE archive")
+
+            if moved:
+                cur.execute("VACUUM")
+            return moved
+        except Exception as e:
+            handle_db_error(e, context="履歴アーカイブ処理")
+            return moved
+        finally:
+            if conn:
+                conn.close()
+
+    def _ensure_archive(self, path, schemas):
+        conn = sqlite3.connect(path)
+        try:
+            cur = conn.cursor()
+            for table, sql in schemas.items():
+                cur.execute(
+                    "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+                    (table,),
+                )
+                if cur.fetchone() is None:
+                    cur.execute(sql)
+            _add_missing_columns(cur)
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _move_month(self, cur, table, ts, month):
+        cur.execute(f"PRAGMA main.table_info({table})")
+        col_sql = ", ".join(r[1] for r in cur.fetchall())
+        if table == "purchase_history":
+            # インポートで採番し直された同一の購入はアーカイブに重複させない
+            duplicate = """
+                AND NOT EXISTS (
+                    SELECT 1 FROM archive.purchase_history a
+                    WHERE a.symbol = m.symbol AND a.purchase_type = m.purchase_type
+                        AND a.date = m.date
+                )
+            """
+        else:
+            duplicate = ""
+        cur.execute(
+            f"""
+            INSERT OR IGNORE INTO archive.{table} ({col_sql})
+            SELECT {col_sql} FROM main.{table} m
+            WHERE substr({ts}, 1, 7) = ? {duplicate}
+            """,
+            (month,),
+        )
+        cur.execute(f"DELETE FROM main.{table} WHERE substr({ts}, 1, 7) = ?", (month,))
+        return cur.rowcount
+
+    # --- バックアップ（本体DBはオンラインバックアップ、アーカイブは未コピー・変更分のみ） ---
+    def backup(self, dest_dir):
+        dest_archive = os.path.join(dest_dir, ARCHIVE_DIRNAME)
+        os.makedirs(dest_archive, exist_ok=True)
+        copied = []
+        src = dst = None
+        try:
+            src = sqlite3.connect(self.db_path)
+            dst = sqlite3.connect(os.path.join(dest_dir, DB_FILENAME))
+            src.backup(dst)
+
+            for month in list_archive_months(self.archive_dir):
+                source = archive_path(self.archive_dir, month)
+                target = archive_path(dest_archive, month)
+                stat = os.stat(source)
+                if os.path.exists(target):
+                    copy = os.stat(target)
+                    if (copy.st_size, int(copy.st_mtime)) == (
+                        stat.st_size,
+                        int(stat.st_mtime),
+                    ):
+                        continue
+                shutil.copy2(source, target)
+                copied.append(month)
+            return copied
+        except Exception as e:
+            handle_db_error(e, context="バックアップ処理")
+            return None
+        finally:
+            if src:
+                src.close()
+            if dst:
+                dst.close()
+
+    def _check_columns(self, table, columns):
+        allowed = TABLE_COLUMNS.get(table)
+        if allowed is None or any(c not in allowed for c in columns):
+            raise ValueError(f"未対応のテーブルまたは列です: {table} {columns}")
+
+
+def _str_or_none(value):
+    return None if value is None else str(value)
+
 
 # --- エラーハンドラ ---
 def handle_db_error(e, context=""):
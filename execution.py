@@ -0,0 +1,210 @@
+# 注文執行エンジン（TWAP分割注文）
+# 大きな金額の注文を複数のスライスに分け、一定間隔で成行注文する。
+# 分割注文はバックグラウンドで並行実行され、スライスごと・注文全体の
+# スリッページを purchase_history に記録する。
+
+import time
+import uuid
+import contextvars
+import logging
+from decimal import Decimal
+from concurrent.futures import ThreadPoolExecutor
+import fixed_point as fp
+from notify import send_slack
+from account import account_service
+from resilience import NOT_SENT_ERRORS
+from api_client import (
+    place_order,
+    get_executions_by_order,
+    get_current_prices,
+    http_client,
+)
+
+logger = logging.getLogger(__name__)
+
+
+# --- 約定一覧から加重平均約定価格（0.01円単位）と約定時刻を求める ---
+def calculate_executed_price(executions):
+    total = sum(
+        fp.parse_fixed(e["price"]) * fp.parse_fixed(e["size"]) for e in executions
+    )
+    size = sum(fp.parse_fixed(e["size"]) for e in executions)
+    executed_price = Decimal(fp.div_round(total * 100, size * fp.SCALE)).scaleb(-2)
+    return executed_price, executions[0]["timestamp"]
+
+
+# --- 基準価格に対するスリッページ（%、0.0001単位） ---
+def calculate_slippage(executed_price, reference_price):
+    change = fp.percent_change(
+        fp.to_fixed(executed_price), fp.to_fixed(reference_price)
+    )
+    return fp.to_decimal(change, 4)
+
+
+# --- 数量を最小注文単位の倍数でslices個に分割する ---
+def split_amount(amount, min_unit, slices):
+    units = int(amount / min_unit)
+    slices = max(1, min(slices, units))
+    base, extra = divmod(units, slices)
+    return [(base + (1 if i < extra else 0)) * min_unit for i in range(slices)]
+
+
+class TwapEngine:
+    def __init__(self, max_workers=4):
+        self.pool = ThreadPoolExecutor(max_workers=max_workers)
+        self.futures = []
+
+    # --- 分割注文を予約する（完了は wait_all で待つ） ---
+    def submit(
+        self,
+        symbol,
+        jpy,
+        amount,
+        min_unit,
+        reference_price,
+        purchase_type,
+        db,
+        exec_cfg,
+        key,
+    ):
+        sizes = split_amount(amount, min_unit, exec_cfg.get("slices", 1))
+        interval = exec_cfg.get("interval_seconds", 60)
+        http_client.extend_run_deadline(interval * (len(sizes) - 1))
+        logger.info(
+            f"{symbol} 分割注文を開始: {len(sizes)}回 × {interval}秒間隔 / 合計数量: {amount}"
+        )
+        # ログの通貨コンテキストをワーカースレッドへ引き継ぐ
+        ctx = contextvars.copy_context()
+        future = self.pool.submit(
+            ctx.run,
+            self._run,
+            symbol,
+            jpy,
+            amount,
+            sizes,
+            reference_price,
+            purchase_type,
+            db,
+            exec_cfg,
+            key,
+        )
+        self.futures.append(future)
+
+    def wait_all(self):
+        for future in self.futures:
+            try:
+                future.result()
+            except Exception as e:
+                logger.error(f"分割注文の実行中にエラーが発生しました: {e}")
+        self.futures = []
+
+    def _run(
+        self,
+        symbol,
+        jpy,
+        amount,
+        sizes,
+        reference_price,
+        purchase_type,
+        db,
+        exec_cfg,
+        key,
+    ):
+        interval = exec_cfg.get("interval_seconds", 60)
+        max_slippage = exec_cfg.get("max_slippage_percent")
+        group = uuid.uuid4().hex[:12]
+        # VWAPは約定価格が取得できたスライスのみで計算し、発注数量は別に数える
+        filled_cost = filled_size = placed_size = 0
+        order_slippage = None
+        unknown = False
+
+        for i, size in enumerate(sizes):
+            if i > 0:
+                time.sleep(interval)
+            slice_price = get_current_prices([symbol]).get(symbol, reference_price)
+
+            try:
+                response, order_id = place_order(symbol, size)
+            except NOT_SENT_ERRORS as e:
+                logger.error(
+                    f"{symbol} スライス{i + 1}の注文を送信できませんでした: {e}"
+                )
+                break
+            except Exception as e:
+                logger.error(f"{symbol} スライス{i + 1}の注文結果が不明です: {e}")
+                unknown = True
+                break
+            if response.status_code != 200 or not order_id:
+                error_msg = (
+                    f"{symbol}注文失敗（スライス{i + 1}/{len(sizes)}）: "
+                    f"{response.status_code} {response.text}"
+                )
+                logger.error(error_msg)
+                send_slack(error_msg)
+                break
+
+            executed_price = executed_time = slippage = None
+            executions = get_executions_by_order(order_id)
+            if executions:
+                try:
+                    executed_price, executed_time = calculate_executed_price(executions)
+                    slippage = calculate_slippage(executed_price, slice_price)
+                    filled_cost += fp.to_fixed(executed_price) * fp.to_fixed(size)
+                    filled_size += fp.to_fixed(size)
+                except Exception as e:
+                    logger.warning(f"約定情報の計算失敗: {e}")
+            placed_size += fp.to_fixed(size)
+
+            db.record_purchase_history(
+                symbol,
+                (Decimal(jpy) * size / amount).quantize(Decimal("0.01")),
+                size,
+                purchase_type,
+                slice_price,
+                executed_price=executed_price,
+                executed_time=executed_time,
+                order_group=group,
+                slice_index=i,
+                slippage_percent=slippage,
+            )
+            logger.info(
+                f"{symbol} スライス{i + 1}/{len(sizes)} 約定 / 数量: {size} / "
+                f"約定価格: {executed_price}円 / スリッページ: {slippage}%"
+            )
+
+            if filled_cost:
+                vwap = Decimal(fp.div_round(filled_cost, filled_size)).scaleb(-8)
+                order_slippage = calculate_slippage(vwap, reference_price)
+                if (
+                    max_slippage is not None
+                    and i < len(sizes) - 1
+                    and order_slippage > Decimal(str(max_slippage))
+                ):
+                    logger.warning(
+                        f"{symbol} スリッページ {order_slippage}% が上限 "
+                        f"{max_slippage}% を超えたため残りのスライスを中止します"
+                    )
+                    break
+
+        db.update_order_slippage(group, order_slippage)
+        placed = fp.to_decimal(placed_size)
+        msg = (
+            f"{symbol} 分割注文完了 / 数量: {placed.normalize()}/{amount} / "
+            f"スリッページ: {order_slippage}%"
+        )
+        logger.info(msg)
+        send_slack(msg)
+
+        # 結果不明のスライスの金額は見込みのまま残し、未発注分のみ残高に戻す
+        if not unknown:
+            unplaced = Decimal(jpy) * (amount - fp.to_decimal(placed_size)) / amount
+            account_service.release(db, unplaced.quantize(Decimal("0.01")))
+
+        # 結果不明のスライスがあり受付済みのスライスもない場合は、pendingのまま残す
+        if placed_size:
+            db.complete_purchase_key(key, "done")
+        elif not unknown:
+            db.complete_purchase_key(key, "failed")
+
+
+execution_engine = TwapEngine()
@@ -0,0 +1,78 @@
+# 固定小数点演算（指標・スコア計算用）
+# 価格を 10^8 倍した整数として扱い、Decimalの生成・丸めをループ内で行わない。
+# Decimalへの変換は表示・注文数量の丸めなど境界部分でのみ行う。
+
+from decimal import Decimal, ROUND_HALF_EVEN
+
+SCALE_DIGITS = 8
+SCALE = 10**SCALE_DIGITS
+RSI_MAX = 10000  # RSI 100.00（0.01単位）
+
+
+# --- 文字列・数値から固定小数点へ ---
+def to_fixed(value):
+    if isinstance(value, int):
+        return value * SCALE
+    d = Decimal(str(value)).scaleb(SCALE_DIGITS)
+    return int(d.to_integral_value(rounding=ROUND_HALF_EVEN))
+
+
+# --- DBの価格文字列の高速変換（指数表記・9桁以上の小数はDecimal経由） ---
+def parse_fixed(text):
+    if "e" in text or "E" in text:
+        return to_fixed(text)
+    whole, _, frac = text.partition(".")
+    if len(frac) > SCALE_DIGITS:
+        return to_fixed(text)
+    negative = whole.startswith("-")
+    value = abs(int(whole or "0")) * SCALE + int(frac.ljust(SCALE_DIGITS, "0"))
+    return -value if negative else value
+
+
+# --- 固定小数点からDecimalへ（places桁に偶数丸め） ---
+def to_decimal(fx, places=SCALE_DIGITS):
+    if places >= SCALE_DIGITS:
+        return Decimal(fx).scaleb(-SCALE_DIGITS)
+    return Decimal(div_round(fx, 10 ** (SCALE_DIGITS - places))).scaleb(-places)
+
+
+# --- 整数除算（偶数丸め。Decimalの既定の丸めと同じ） ---
+def div_round(n, d):
+    if d < 0:
+        n, d = -n, -d
+    q, r = divmod(n, d)
+    twice = 2 * r
+    if twice > d or (twice == d and q % 2 == 1):
+        q += 1
+    return q
+
+
+# --- 変化率（%）の固定小数点値 ---
+def percent_change(curr, base):
+    return div_round((curr - base) * 100 * SCALE, base)
+
+
+# --- 変化率（%）がしきい値以下か（除算を行わず厳密に比較、base>0） ---
+def percent_change_at_most(curr, base, threshold):
+    return (curr - base) * 100 * SCALE <= threshold * base
+
+
+# --- 直近 period+1 件の値上がり幅・値下がり幅の合計 ---
+def gains_losses(values, period):
+    window = values[-(period + 1) :]
+    gains = losses = 0
+    for prev, curr in zip(window, window[1:]):
+        diff = curr - prev
+        if diff > 0:
+            gains += diff
+        else:
+            losses -= diff
+    return gains, losses
+
+
+# --- 値上がり幅・値下がり幅の合計からRSI（0.01単位の整数） ---
+def rsi_from_moves(gains, losses):
+    if losses == 0:
+        return RSI_MAX
+    # 100 - 100 / (1 + G/L) = 100 * G / (G + L)
+    return div_round(RSI_MAX * gains, gains + losses)
@@ -0,0 +1,333 @@
+# 履歴データの列指向エクスポート／インポート
+# 各テーブルを列ごとの .npy ファイルとして書き出す。
+# 価格・数量などの数値列は fp.SCALE 倍した整数（<i8）、日付は datetime64（<M8）、
+# それ以外は固定長バイト列（|S）で、NULLは INT64_MIN（datetime64ではNaT）とする。
+# 数値・日付に変換すると元の文字列を再現できない値（小数第9位以下を含む価格など）は、
+# 同じ行位置の文字列を {列名}.text.npy に残し、インポート時はそちらを使う。
+# NumPy側では np.load(path, mmap_mode="r") でそのままメモリマップできる。
+
+import os
+import ast
+import json
+import mmap
+import struct
+import logging
+import datetime
+import fixed_point as fp
+from db_manager import TABLE_COLUMNS
+
+logger = logging.getLogger(__name__)
+
+NPY_MAGIC = b"\x93NUMPY"
+NPY_ALIGN = 64
+MANIFEST_FILENAME = "manifest.json"
+DEFAULT_BATCH_SIZE = 5000
+INT64_MIN = -(2**63)
+EPOCH = datetime.datetime(1970, 1, 1)
+
+# --- 列の型（記載のない列は文字列） ---
+# fixed: fp.SCALE倍した整数 / int: 整数 / date: 日付 / datetime: 日時（秒）
+COLUMN_KINDS = {
+    "price_history": {
+        "date": "date",
+        "price": "fixed",
+        "open": "fixed",
+        "high": "fixed",
+        "low": "fixed",
+        "close": "fixed",
+        "twap": "fixed",
+        "samples": "int",
+    },
+    "short_term_price": {"timestamp": "datetime", "price": "fixed"},
+    "purchase_history": {
+        "date": "datetime",
+        "jpy_amount": "fixed",
+        "crypto_amount": "fixed",
+        "price": "fixed",
+        "executed_price": "fixed",
+        "slice_index": "int",
+        "slippage_percent": "fixed",
+        "order_slippage_percent": "fixed",
+    },
+}
+KIND_DTYPES = {"fixed": "<i8", "int": "<i8", "date": "<M8[D]", "datetime": "<M8[s]"}
+
+# --- 約定価格は未取得時に文字列 "None" で記録されている（NOT NULL列） ---
+NONE_TEXT_COLUMNS = {("purchase_history", "executed_price")}
+
+
+# --- .npyヘッダ生成 ---
+def _npy_header(descr, count):
+    header = f"{{'descr': '{descr}', 'fortran_order': False, 'shape': ({count},), }}"
+    # magic(6) + version(2) + header長(2) + header を64バイト境界に揃える
+    padding = NPY_ALIGN - (10 + len(header) + 1) % NPY_ALIGN
+    header = header + " " * (padding % NPY_ALIGN) + "\n"
+    return NPY_MAGIC + b"\x01\x00" + struct.pack("<H", len(header)) + header.encode()
+
+
+# --- .npyヘッダ読み込み（戻り値: データ開始位置, dtype, 件数） ---
+def _read_npy_header(buf):
+    if buf[:6] != NPY_MAGIC:
+        raise ValueError("npy形式ではありません")
+    major = buf[6]
+    if major == 1:
+        (header_len,) = struct.unpack("<H", buf[8:10])
+        offset = 10
+    else:
+        (header_len,) = struct.unpack("<I", buf[8:12])
+        offset = 12
+    header = ast.literal_eval(buf[offset : offset + header_len].decode("latin1"))
+    descr = header["descr"]
+    if header["fortran_order"] or not (
+        descr.startswith("|S") or descr in KIND_DTYPES.values()
+    ):
+        raise ValueError(f"未対応のdtypeです: {descr}")
+    return offset + header_len, descr, header["shape"][0]
+
+
+def _is_null(value):
+    return value is None or value == "None"
+
+
+# --- 値を列の型に変換する（数値・日付はint64、文字列はバイト列） ---
+def _to_int(kind, value):
+    if _is_null(value):
+        return INT64_MIN
+    if kind == "fixed":
+        return fp.parse_fixed(str(value))
+    if kind == "int":
+        return int(value)
+    if kind == "date":
+        return (datetime.date.fromisoformat(value) - EPOCH.date()).days
+    return (datetime.datetime.fromisoformat(value) - EPOCH) // datetime.timedelta(
+        seconds=1
+    )
+
+
+def _from_int(kind, value):
+    if value == INT64_MIN:
+        return None
+    if kind == "fixed":
+        return format(fp.to_decimal(value).normalize(), "f")
+    if kind == "int":
+        return value
+    if kind == "date":
+        return (EPOCH + datetime.timedelta(days=value)).strftime("%Y-%m-%d")
+    return (EPOCH + datetime.timedelta(seconds=value)).strftime("%Y-%m-%d %H:%M:%S")
+
+
+# --- 数値・日付への変換と、元の値を再現できない場合の文字列（不要なら None） ---
+def _to_int_exact(kind, value, none_text):
+    try:
+        converted = _to_int(kind, value)
+    except ValueError:
+        return INT64_MIN, value
+    restored = _from_int(kind, converted)
+    if none_text and restored is None:
+        restored = "None"
+    return converted, None if restored == value else value
+
+
+# --- NULLは空文字として書き出す ---
+def _encode(value):
+    return b"" if value is None else str(value).encode("ascii")
+
+
+def _text_filename(col):
+    return f"{col}.text.npy"
+
+
+class _ColumnWriter:
+    """テーブルの各列を .npy ファイルへ順次書き出す"""
+
+    def __init__(self, table_dir, table, columns):
+        self.table_dir = table_dir
+        self.columns = columns
+        self.kinds = [COLUMN_KINDS.get(table, {}).get(c) for c in columns]
+        self.none_text = [(table, c) in NONE_TEXT_COLUMNS for c in columns]
+        self.files = []
+        self.text_files = []
+        self.dtypes = []
+        self.widths = []
+        self.count = 0
+
+    def _open(self, filename, dtype, count):
+        f = open(os.path.join(self.table_dir, filename), "wb")
+        f.write(_npy_header(dtype, count))
+        return f
+
+    def begin(self, count, widths):
+        self.count = count
+        for col, kind, width in zip(self.columns, self.kinds, widths):
+            width = max(width, 1)
+            dtype = KIND_DTYPES[kind] if kind else f"|S{width}"
+            self.files.append(self._open(f"{col}.npy", dtype, count))
+            self.text_files.append(
+                self._open(_text_filename(col), f"|S{width}", count) if kind else None
+            )
+            self.dtypes.append(dtype)
+            self.widths.append(width)
+
+    def write(self, rows):
+        for i, (f, text_f, kind, width) in enumerate(
+            zip(self.files, self.text_files, self.kinds, self.widths)
+        ):
+            if kind:
+                pairs = [_to_int_exact(kind, r[i], self.none_text[i]) for r in rows]
+                f.write(struct.pack(f"<{len(pairs)}q", *(v for v, _ in pairs)))
+                text_f.write(b"".join(_encode(t).ljust(width, b"\0") for _, t in pairs))
+            else:
+                f.write(b"".join(_encode(r[i]).ljust(width, b"\0") for r in rows))
+
+    def close(self):
+        for f in self.files + self.text_files:
+            if f:
+                f.close()
+
+    def manifest_columns(self):
+        columns = {}
+        for col, kind, dtype in zip(self.columns, self.kinds, self.dtypes):
+            columns[col] = {"dtype": dtype}
+            if kind == "fixed":
+                columns[col]["scale"] = fp.SCALE
+            if kind:
+                columns[col]["text"] = _text_filename(col)
+        return columns
+
+
+# --- 履歴データのエクスポート ---
+def export_history(db, out_dir, batch_size=DEFAULT_BATCH_SIZE):
+    os.makedirs(out_dir, exist_ok=True)
+    manifest = {
+        "format": "npy-columns",
+        "version": 2,
+        "exported_at": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "null": INT64_MIN,
+        "tables": {},
+    }
+
+    for table, columns in TABLE_COLUMNS.items():
+        table_dir = os.path.join(out_dir, table)
+        os.makedirs(table_dir, exist_ok=True)
+        writer = _ColumnWriter(table_dir, table, columns)
+        try:
+            ok = db.stream_table(
+                table, columns, writer.begin, writer.write, batch_size=batch_size
+            )
+        finally:
+            writer.close()
+        if not ok:
+            logger.error(f"{table} のエクスポートに失敗しました")
+            return None
+
+        manifest["tables"][table] = {
+            "rows": writer.count,
+            "columns": writer.manifest_columns(),
+        }
+        logger.info(f"{table} をエクスポート: {writer.count} 件")
+
+    with open(os.path.join(out_dir, MANIFEST_FILENAME), "w") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+# --- マニフェストとdtypeから列の型を決める（旧形式は全列が文字列） ---
+def _column_kind(meta, descr):
+    if descr.startswith("|S"):
+        return None
+    if descr == "<i8":
+        return "fixed" if isinstance(meta, dict) and "scale" in meta else "int"
+    return "date" if descr == KIND_DTYPES["date"] else "datetime"
+
+
+# --- 固定長バイト列の start〜stop 行を文字列で返す（空はNone） ---
+def _read_text(m, offset, width, start, stop):
+    return [
+        m[offset + i * width : offset + (i + 1) * width].rstrip(b"\0").decode("ascii")
+        or None
+        for i in range(start, stop)
+    ]
+
+
+# --- 列ファイルをメモリマップし、バッチ単位で行を返す ---
+def _iter_column_batches(table_dir, table, columns, count, batch_size):
+    handles, maps = [], []
+
+    def open_map(filename):
+        f = open(os.path.join(table_dir, filename), "rb")
+        handles.append(f)
+        m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        maps.append(m)
+        offset, descr, n = _read_npy_header(m)
+        if n != count:
+            raise ValueError(f"{filename} の件数が一致しません: {n} != {count}")
+        return m, offset, descr
+
+    layouts = []
+    try:
+        for col, meta in columns.items():
+            m, offset, descr = open_map(f"{col}.npy")
+            kind = _column_kind(meta, descr)
+            if kind == "fixed" and meta["scale"] != fp.SCALE:
+                raise ValueError(f"{col} の倍率が一致しません: {meta['scale']}")
+            text = None
+            if kind and isinstance(meta, dict) and meta.get("text"):
+                text_m, text_offset, text_descr = open_map(meta["text"])
+                text = (text_m, text_offset, int(text_descr[2:]))
+            none_text = (table, col) in NONE_TEXT_COLUMNS
+            width = int(descr[2:]) if kind is None else 8
+            layouts.append((m, offset, kind, width, text, none_text))
+
+        for start in range(0, count, batch_size):
+            stop = min(start + batch_size, count)
+            cols = []
+            for m, offset, kind, width, text, none_text in layouts:
+                if kind:
+                    raw = struct.unpack_from(
+                        f"<{stop - start}q", m, offset + start * width
+                    )
+                    values = [_from_int(kind, v) for v in raw]
+                else:
+                    values = _read_text(m, offset, width, start, stop)
+                if none_text:
+                    values = ["None" if v is None else v for v in values]
+                if text:
+                    originals = _read_text(*text, start, stop)
+                    values = [
+                        t if t is not None else v for v, t in zip(values, originals)
+                    ]
+                cols.append(values)
+            yield list(zip(*cols))
+    finally:
+        for m in maps:
+            m.close()
+        for f in handles:
+            f.close()
+
+
+# --- 履歴データのインポート（失敗したテーブルがあれば None を返す） ---
+def import_history(db, in_dir, batch_size=DEFAULT_BATCH_SIZE):
+    manifest_path = os.path.join(in_dir, MANIFEST_FILENAME)
+    if not os.path.exists(manifest_path):
+        logger.error(f"マニフェストが見つかりません: {manifest_path}")
+        return None
+
+    with open(manifest_path, "r") as f:
+        manifest = json.load(f)
+
+    result = {}
+    for table, meta in manifest.get("tables", {}).items():
+        if table not in TABLE_COLUMNS:
+            logger.warning(f"{table} は未対応のテーブルのためスキップします")
+            continue
+        columns = meta["columns"]
+        batches = _iter_column_batches(
+            os.path.join(in_dir, table), table, columns, meta["rows"], batch_size
+        )
+        inserted, ok = db.import_rows(table, list(columns), batches)
+        result[table] = inserted
+        logger.info(f"{table} をインポート: {inserted}/{meta['rows']} 件")
+        if not ok:
+            logger.error(f"{table} のインポートに失敗しました")
+            return None
+    return result
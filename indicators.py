@@ -0,0 +1,284 @@
+# 追加購入の判定に使う指標のレジストリと評価器
+# 各指標は必要な入力（日次終値・前回購入価格・短期指標）と参照期間を宣言する。
+# 評価器は実行ごとに全通貨・全ルールの必要データをまとめて1回ずつ取得し、
+# 窓内合計や値上がり・値下がり幅などの中間値を指標間でメモ化する。
+
+import math
+import logging
+import datetime
+from decimal import Decimal
+import fixed_point as fp
+
+logger = logging.getLogger(__name__)
+
+INDICATORS = {}
+
+
+class Indicator:
+    def __init__(self, name, func, inputs, lookback, missing, mark_format):
+        self.name = name
+        self.func = func
+        self.inputs = inputs
+        self.lookback = lookback
+        self.missing = missing
+        self.mark_format = mark_format
+
+
+# --- 指標の登録 ---
+# inputs: "daily"（日次終値）/ "last_purchase"（前回購入価格）/ "intraday"（短期指標）
+# lookback: ルールから必要な日次終値の件数を返す関数
+# missing: データ不足時に判定理由へ記録する文言（Noneなら記録しない）
+# mark_format: 判定理由の末尾に付ける加点表記（+1 / ±0 など）の書式
+# 指標関数は (評価器, 通貨, ルール, 現在価格) を受け取り、
+# (条件を満たしたか, 判定理由) またはデータ不足時に None を返す
+def indicator(name, inputs=(), lookback=None, missing=None, mark_format=" ({})"):
+    def register(func):
+        INDICATORS[name] = Indicator(
+            name,
+            func,
+            set(inputs),
+            lookback or (lambda rule: 0),
+            missing,
+            mark_format,
+        )
+        return func
+
+    return register
+
+
+# --- 設定に rules がない場合は従来の判定項目から組み立てる ---
+def default_rules(conf):
+    rules = [
+        {"indicator": "price_drop", "threshold": conf.get("price_drop_percent", -3)},
+        {"indicator": "sma_deviation", "threshold": conf.get("sma_deviation", -5)},
+        {"indicator": "rsi", "threshold": conf.get("rsi_threshold", 30)},
+    ]
+    icfg = conf.get("intraday") or {}
+    if "rsi_threshold" in icfg:
+        rules.append({"indicator": "intraday_rsi", "threshold": icfg["rsi_threshold"]})
+    if "band_sigma" in icfg:
+        rules.append({"indicator": "intraday_band"})
+    rules.append({"indicator": "long_term_downtrend", "weight": -1})
+    return rules
+
+
+class IndicatorEvaluator:
+    def __init__(self, db, add_settings):
+        self.db = db
+        self.rules = {
+            symbol: conf.get("rules") or default_rules(conf)
+            for symbol, conf in add_settings.items()
+            if conf.get("jpy", 0) > 0
+        }
+        self._memo = {}
+        self._prepare(add_settings)
+
+    # --- 全ルールが必要とする入力の和集合を一括取得する ---
+    def _prepare(self, add_settings):
+        inputs = set()
+        days = 0
+        for rules in self.rules.values():
+            for rule in rules:
+                ind = INDICATORS[rule["indicator"]]
+                inputs |= ind.inputs
+                days = max(days, ind.lookback(rule))
+
+        symbols = list(self.rules)
+        today = datetime.datetime.now().strftime("%Y-%m-%d")
+        self.closes = {}
+        self.last_prices = {}
+        self.intraday = {}
+        if "daily" in inputs:
+            series = self.db.get_price_series_bulk(symbols, days)
+            self.closes = {s: [p for _, p in rows] for s, rows in series.items()}
+        if "last_purchase" in inputs:
+            self.last_prices = self.db.get_last_purchase_prices(symbols, today)
+        if "intraday" in inputs:
+            self.intraday = load_intraday_indicators(add_settings, self.db)
+
+    def memo(self, key, func):
+        if key not in self._memo:
+            self._memo[key] = func()
+        return self._memo[key]
+
+    # --- 直近から shift 件さかのぼった位置までの days 件の終値 ---
+    def window(self, symbol, days, shift=0):
+        closes = self.closes.get(symbol, [])
+        end = len(closes) - shift
+        return closes[max(end - days, 0) : max(end, 0)]
+
+    def window_sum(self, symbol, days, shift=0):
+        return self.memo(
+            ("sum", symbol, days, shift),
+            lambda: sum(self.window(symbol, days, shift)),
+        )
+
+    def moves(self, symbol, period):
+        return self.memo(
+            ("moves", symbol, period),
+            lambda: fp.gains_losses(self.closes.get(symbol, []), period),
+        )
+
+    # --- 購入スコアを計算する ---
+    def score(self, symbol, conf, current_price):
+        score = 0
+        max_score = 0
+        min_score = conf.get("min_score", 2)  # 購入判定に使われるしきい値
+        reasons = []
+        current = fp.to_fixed(current_price)
+
+        for rule in self.rules.get(symbol, []):
+            ind = INDICATORS[rule["indicator"]]
+            weight = rule.get("weight", 1)
+            if weight > 0:
+                max_score += weight
+
+            result = ind.func(self, symbol, rule, current)
+            if result is None:
+                if ind.missing and ind.missing not in reasons:
+                    reasons.append(ind.missing)
+                continue
+
+            passed, reason = result
+            if passed:
+                score += weight
+            mark = f"{weight:+}" if passed else "±0"
+            reasons.append(reason + ind.mark_format.format(mark))
+
+        reasons.insert(0, f"スコア={score}/{max_score}（条件:{min_score}以上）")
+        return score, reasons
+
+
+# --- 前回購入価格からの下落率 ---
+@indicator("price_drop", inputs=("last_purchase",), missing="前回価格なし")
+def price_drop(ev, symbol, rule, current):
+    price = ev.last_prices.get(symbol)
+    if not price:
+        return None
+    last = fp.parse_fixed(price)
+    change = fp.to_decimal(fp.percent_change(current, last))
+    threshold = fp.to_fixed(rule.get("threshold", -3))
+    return fp.percent_change_at_most(current, last, threshold), f"前回比 {change:.2f}%"
+
+
+# --- 移動平均（日次終値）からの乖離率 ---
+@indicator("sma_deviation", inputs=("daily",), lookback=lambda r: r.get("days", 30))
+def sma_deviation(ev, symbol, rule, current):
+    days = rule.get("days", 30)
+    count = len(ev.window(symbol, days))
+    if count == 0:
+        return None
+    avg = fp.div_round(ev.window_sum(symbol, days), count)
+    sma_dev = fp.to_decimal(fp.percent_change(current, avg))
+    threshold = fp.to_fixed(rule.get("threshold", -5))
+    return fp.percent_change_at_most(current, avg, threshold), f"SMA乖離 {sma_dev:.2f}%"
+
+
+# --- RSI（日次終値） ---
+@indicator(
+    "rsi",
+    inputs=("daily",),
+    lookback=lambda r: r.get("period", 14) + 1,
+    missing="RSI未取得",
+)
+def rsi(ev, symbol, rule, current):
+    period = rule.get("period", 14)
+    if len(ev.closes.get(symbol, [])) < period + 1:
+        return None
+    value = fp.rsi_from_moves(*ev.moves(symbol, period))
+    rsi = Decimal("100") if value == fp.RSI_MAX else Decimal(value).scaleb(-2)
+    threshold = Decimal(str(rule.get("threshold", 30)))
+    return fp.to_fixed(rsi) <= fp.to_fixed(threshold), f"RSI {rsi} ≤ {threshold}"
+
+
+# --- 期間内の最高値（日次終値）からの下落率 ---
+@indicator("drawdown", inputs=("daily",), lookback=lambda r: r.get("days", 30))
+def drawdown(ev, symbol, rule, current):
+    days = rule.get("days", 30)
+    window = ev.window(symbol, days)
+    if not window:
+        return None
+    high = ev.memo(("max", symbol, days), lambda: max(window))
+    change = fp.to_decimal(fp.percent_change(current, high))
+    threshold = fp.to_fixed(rule.get("threshold", -10))
+    return (
+        fp.percent_change_at_most(current, high, threshold),
+        f"{days}日高値比 {change:.2f}%",
+    )
+
+
+# --- 長期下落トレンド（直近の移動平均が shift 日前の移動平均を下回る） ---
+@indicator(
+    "long_term_downtrend",
+    inputs=("daily",),
+    lookback=lambda r: r.get("days", 30) + r.get("shift", 7),
+    mark_format="（{}）",
+)
+def long_term_downtrend(ev, symbol, rule, current):
+    days = rule.get("days", 30)
+    shift = rule.get("shift", 7)
+    if len(ev.closes.get(symbol, [])) < days + shift:
+        return False, "長期トレンド良好"
+    # 期間が同じため、平均の比較は合計の比較と等価
+    down = ev.window_sum(symbol, days) < ev.window_sum(symbol, days, shift)
+    return down, "長期トレンド悪化" if down else "長期トレンド良好"
+
+
+# --- 短期RSI ---
+@indicator("intraday_rsi", inputs=("intraday",), missing="短期指標未取得")
+def intraday_rsi(ev, symbol, rule, current):
+    data = ev.intraday.get(symbol)
+    if data is None:
+        return None
+    threshold = Decimal(str(rule.get("threshold", 30)))
+    return (
+        fp.to_fixed(data["rsi"]) <= fp.to_fixed(threshold),
+        f"短期RSI({data['interval']}分足) {data['rsi']} ≤ {threshold}",
+    )
+
+
+# --- 短期ボリンジャーバンド下限 ---
+@indicator("intraday_band", inputs=("intraday",), missing="短期指標未取得")
+def intraday_band(ev, symbol, rule, current):
+    data = ev.intraday.get(symbol)
+    if data is None:
+        return None
+    return (
+        current <= fp.to_fixed(data["lower"]),
+        f"短期バンド下限({data['interval']}分足) {data['lower']:.2f}",
+    )
+
+
+# --- 短期指標（短期価格の足から計算したRSI・SMA・バンド）の取得 ---
+def load_intraday_indicators(add_settings, db):
+    groups = {}
+    for symbol, conf in add_settings.items():
+        icfg = conf.get("intraday")
+        if not icfg or conf.get("jpy", 0) <= 0:
+            continue
+        key = (icfg.get("interval_minutes", 60), icfg.get("period", 14))
+        groups.setdefault(key, []).append(symbol)
+
+    result = {}
+    now = datetime.datetime.now()
+    for (interval, period), symbols in groups.items():
+        # 欠測を見込んで必要な足数の2倍の期間を対象にする
+        since = now - datetime.timedelta(minutes=interval * (period + 1) * 2)
+        rows = db.get_intraday_indicators(
+            symbols, interval, period, since.strftime("%Y-%m-%d %H:%M:%S")
+        )
+        for symbol, r in rows.items():
+            if r["moves"] < period:
+                logger.info(f"{symbol} の短期指標用データが不足しています")
+                continue
+            sigma = Decimal(str(add_settings[symbol]["intraday"].get("band_sigma", 2)))
+            sma = Decimal(str(r["sma"]))
+            std = Decimal(str(math.sqrt(max(r["variance"], 0.0))))
+            result[symbol] = {
+                "interval": interval,
+                "rsi": Decimal(str(r["rsi"])).quantize(Decimal("0.01")),
+                "sma": sma,
+                "lower": sma - sigma * std,
+                "upper": sma + sigma * std,
+            }
+    return result
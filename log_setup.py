@@ -0,0 +1,153 @@
+# ログ出力の初期化
+# ログはQueueHandler経由でバックグラウンドスレッドが書き込むため、
+# 呼び出し側（注文処理など）はディスクI/Oで待たされない。
+# 月別ファイルへの追記のみを行い、リネームや削除はしないため、
+# cron の各モードや serve など複数プロセスが同じファイルに書き込んでも安全。
+# 古いログの圧縮・削除は月次の archive モードでまとめて行う。
+
+import os
+import gzip
+import json
+import time
+import uuid
+import queue
+import shutil
+import atexit
+import datetime
+import logging
+import contextvars
+from logging.handlers import QueueHandler, QueueListener
+
+TEXT_FORMAT = "[%(asctime)s] [%(levelname)s] %(message)s"
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+RUN_ID = uuid.uuid4().hex[:8]
+_run_context = {"run_id": RUN_ID, "mode": None}
+_symbol = contextvars.ContextVar("log_symbol", default=None)
+_listener = None
+_file_handler = None
+
+
+class _ContextFilter(logging.Filter):
+    """呼び出し元スレッドで実行ID・モード・通貨をレコードに付与する"""
+
+    def filter(self, record):
+        record.run_id = _run_context["run_id"]
+        record.mode = _run_context["mode"]
+        if not hasattr(record, "symbol"):
+            record.symbol = _symbol.get()
+        return True
+
+
+class JsonLinesFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record, DATE_FORMAT),
+            "level": record.levelname,
+            "logger": record.name,
+            "run_id": getattr(record, "run_id", None),
+            "mode": getattr(record, "mode", None),
+            "symbol": getattr(record, "symbol", None),
+            "elapsed_ms": round(record.relativeCreated),
+            "message": record.getMessage(),
+        }
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class MonthlyFileHandler(logging.FileHandler):
+    """log/YYYY-MM.log に追記し、月が変わったら新しい月のファイルに切り替える"""
+
+    def __init__(self, log_dir):
+        self.log_dir = log_dir
+        self.month = f"{datetime.datetime.now():%Y-%m}"
+        super().__init__(self._path(), encoding="utf-8", delay=True)
+
+    def _path(self):
+        return os.path.join(self.log_dir, f"{self.month}.log")
+
+    def emit(self, record):
+        month = f"{datetime.datetime.now():%Y-%m}"
+        if month != self.month:
+            self.close()
+            self.month = month
+            self.baseFilename = os.path.abspath(self._path())
+        super().emit(record)
+
+
+# --- ログ出力の初期化（モジュールimport前に呼び出す） ---
+def setup_logging(log_dir):
+    global _listener, _file_handler
+
+    os.makedirs(log_dir, exist_ok=True)
+    _file_handler = MonthlyFileHandler(log_dir)
+    _file_handler.setFormatter(logging.Formatter(TEXT_FORMAT, datefmt=DATE_FORMAT))
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = QueueHandler(log_queue)
+    queue_handler.addFilter(_ContextFilter())
+
+    root = logging.getLogger()
+    root.setLevel(logging.INFO)
+    root.addHandler(queue_handler)
+
+    _listener = QueueListener(log_queue, _file_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+
+# --- 設定ファイルの内容を反映 ---
+def configure_logging(cfg):
+    cfg = cfg or {}
+    if _file_handler is not None and cfg.get("json", False):
+        _file_handler.setFormatter(JsonLinesFormatter())
+
+
+# --- 前々月以前のログを圧縮し、保持期間を過ぎたものを削除（archive モードから実行） ---
+# 月の切り替わり直後は前月のファイルに書き込み中のプロセスがあり得るため、前月分は残す
+def cleanup_old_logs(log_dir, retention_days):
+    first_of_month = datetime.date.today().replace(day=1)
+    last_month = (first_of_month - datetime.timedelta(days=1)).strftime("%Y-%m")
+    expire_before = time.time() - retention_days * 86400
+
+    for name in os.listdir(log_dir):
+        path = os.path.join(log_dir, name)
+        if not os.path.isfile(path):
+            continue
+        if os.path.getmtime(path) < expire_before:
+            os.remove(path)
+        elif name.endswith(".log") and name[:7] < last_month:
+            _compress(path)
+
+
+def _compress(path):
+    # 別プロセスと同時に実行されても1回だけ圧縮されるよう、先にリネームで確保する
+    work = f"{path}.{os.getpid()}.tmp"
+    try:
+        os.rename(path, work)
+    except FileNotFoundError:
+        return
+    with open(work, "rb") as f_in, gzip.open(path + ".gz", "wb") as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    os.remove(work)
+
+
+def set_log_context(mode=None):
+    _run_context["mode"] = mode
+
+
+# --- 通貨ごとのループで各ログに通貨シンボルを付与する ---
+def log_symbols(items):
+    token = _symbol.set(None)
+    try:
+        for item in items:
+            _symbol.set(item[0] if isinstance(item, tuple) else item)
+            yield item
+    finally:
+        _symbol.reset(token)
+
+
+def shutdown_logging():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
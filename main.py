@@ -4,46 +4,66 @@
 import os
 import sys
 import argparse
-import datetime
 import logging
+import datetime
 from decimal import Decimal
+from log_setup import (
+    setup_logging,
+    configure_logging,
+    cleanup_old_logs,
+    set_log_context,
+    log_symbols,
+)
 
 # --- Logger初期設定（モジュールimport前に設定） ---
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 LOG_DIR = os.path.join(BASE_DIR, "log")
-os.makedirs(LOG_DIR, exist_ok=True)
 
+setup_logging(LOG_DIR)
 logger = logging.getLogger()  # root logger
-logger.setLevel(logging.INFO)
-
-log_file_path = os.path.join(LOG_DIR, f"{datetime.datetime.now():%Y-%m}.log")
-file_handler = logging.FileHandler(log_file_path, encoding="utf-8")
-formatter = logging.Formatter(
-    "[%(asctime)s] [%(levelname)s] %(message)s", datefmt="%Y-%m-%d %H:%M:%S"
-)
-file_handler.setFormatter(formatter)
-logger.addHandler(file_handler)
 
 # --- モジュールimport ---
 from config import settings, BASE_DIR, DATA_DIR  # noqa: E402
 from db_manager import DBManager  # noqa: E402
 from notify import send_email, send_slack  # noqa: E402
 from purchase import execute_base_purchase, execute_add_purchase_flow  # noqa: E402 E501
+from history_io import export_history, import_history  # noqa: E402
+from coordinator import RunLease  # noqa: E402
+from dashboard import serve_dashboard  # noqa: E402
+from account import account_service  # noqa: E402
 from api_client import (  # noqa: E402
     get_current_prices,
-    get_jpy_balance,
     initialize_price_history_if_needed,
+    backfill_price_history_gaps,
+    get_cache_stats,
+    get_api_metrics,
+    get_price_feed_stats,
+    http_client,
 )
 
+# --- API呼び出しに実行期限を設ける実行モード ---
+TIME_BOUNDED_MODES = (
+    "record-price",
+    "record-shortterm",
+    "basecheck",
+    "dropcheck",
+    "alertcheck",
+)
+
+# --- 実行リースで多重起動を防ぐ実行モード（注文を伴うもの） ---
+LEASED_MODES = ("basecheck", "dropcheck")
+
 # --- 設定読み込みチェック ---
 if settings is None:
     logger.critical("設定ファイルの読み込みに失敗しました。")
     sys.exit(1)
 
+configure_logging(settings.get("logging"))
+
 
-def check_balance():
+def check_balance(db, current_prices):
     threshold = Decimal(str(settings.get("balance_warning_threshold_jpy", 0)))
-    balance = get_jpy_balance()
+    balance = account_service.jpy_balance(db)
     if balance is not None and balance < threshold:
         msg = f"日本円残高がしきい値を下回りました: {balance}円（閾値: {threshold}円）"
         logger.warning(msg)
@@ -51,29 +71,75 @@ def check_balance():
         send_slack(msg)
         send_email("【自動積立BOT】残高警告", msg)
 
+    values = account_service.portfolio_value(db, current_prices)
+    if values:
+        detail = " / ".join(f"{s}: {v:,.0f}円" for s, v in values.items())
+        logger.info(f"保有資産評価額: {sum(values.values()):,.0f}円（{detail}）")
+
 
 def update_all_price_history(db):
     symbols = list(settings["base_purchase"]["settings"].keys())
-    current_prices = get_current_prices(symbols)
+    today = datetime.date.today()
+    yesterday = (today - datetime.timedelta(days=1)).isoformat()
+    cfg = settings.get("price_history", {})
+
+    # 前日までの日次価格を短期価格（record-shortterm）から集計する
+    written = db.aggregate_daily_prices(
+        symbols,
+        today.isoformat(),
+        cfg.get("daily_price", "twap"),
+        min_samples=cfg.get("min_samples", 24),
+        min_coverage_hours=cfg.get("min_coverage_hours", 18),
+    )
+    counts = {}
+    for symbol, _ in written:
+        counts[symbol] = counts.get(symbol, 0) + 1
+    for symbol, count in log_symbols(counts.items()):
+        logger.info(f"{symbol} 短期価格から日次価格を集計: {count}日分")
+
+    # 前日の短期価格がない・不足している通貨は従来どおり現在価格を当日の価格として記録する
+    aggregated = db.get_aggregated_symbols(yesterday)
+    fallback = [s for s in symbols if s not in aggregated]
+    if not fallback:
+        return
+    current_prices = get_current_prices(fallback)
 
-    for symbol, price in current_prices.items():
+    rows = []
+    for symbol, price in log_symbols(current_prices.items()):
         if price is None:
             logger.warning(f"{symbol} の価格取得に失敗しました")
             continue
-        db.record_price_history(symbol, price)
-        logger.info(f"{symbol} 現在価格を記録: {price} 円")
+        rows.append((symbol, price, None))
+
+    # 全通貨を1トランザクションで記録する
+    results = db.record_price_histories(rows)
+    outcomes = [
+        (symbol, price, error) for (symbol, price, _), error in zip(rows, results)
+    ]
+    for symbol, price, error in log_symbols(outcomes):
+        if error is None:
+            logger.info(f"{symbol} 現在価格を記録: {price} 円")
 
 
 def save_all_short_term_prices(db):
     symbols = list(settings["base_purchase"]["settings"].keys())
     current_prices = get_current_prices(symbols)
 
-    for symbol, price in current_prices.items():
+    rows = []
+    for symbol, price in log_symbols(current_prices.items()):
         if price is None:
             logger.warning(f"{symbol} の価格取得に失敗しました")
             continue
-        db.record_short_term_price(symbol, price)
-        logger.info(f"{symbol} 短期価格を記録: {price}円")
+        rows.append((symbol, price, None))
+
+    # 全通貨を1トランザクションで記録する
+    results = db.record_short_term_prices(rows)
+    outcomes = [
+        (symbol, price, error) for (symbol, price, _), error in zip(rows, results)
+    ]
+    for symbol, price, error in log_symbols(outcomes):
+        if error is None:
+            logger.info(f"{symbol} 短期価格を記録: {price}円")
 
 
 def check_sudden_price_change(db):
@@ -88,7 +154,8 @@ def check_sudden_price_change(db):
         settings["base_purchase"]["settings"].keys()
     )
 
-    for symbol in symbols:
+    alerts = []
+    for symbol in log_symbols(symbols):
         rows = db.get_latest_short_term_prices(symbol, limit=2)
 
         if len(rows) < 2:
@@ -106,6 +173,7 @@ def check_sudden_price_change(db):
                 f"{symbol} 急落検知 / 変化率: {change:.2f}% / 現在価格: {new_price}）"
             )
             logger.info(log_msg)
+            alerts.append((symbol, "drop", change, new_price))
 
             send_slack(log_msg, level="ALERT")
 
@@ -114,8 +182,11 @@ def check_sudden_price_change(db):
                 f"{symbol} 急騰検知 / 変化率: {change:.2f}% / 現在価格: {new_price}）"
             )
             logger.info(log_msg)
+            alerts.append((symbol, "rise", change, new_price))
             send_slack(log_msg, level="ALERT")
 
+    db.record_alerts(alerts)
+
 
 def main():
     db = DBManager(data_dir=DATA_DIR)
@@ -131,20 +202,67 @@ def main():
             "dropcheck",
             "init-history",
             "alertcheck",
+            "export-history",
+            "import-history",
+            "serve",
+            "archive",
+            "backup",
         ],
         required=True,
     )
     parser.add_argument("--symbol", help="履歴補完する通貨シンボル（例: BTC）")
     parser.add_argument("--force", action="store_true", help="履歴があっても強制再取得")
+    parser.add_argument(
+        "--path",
+        help="履歴エクスポート／インポート・バックアップ先のディレクトリ"
+        "（省略時は data/export、バックアップは data/backup）",
+    )
     parser.add_argument(
         "--dry-run", action="store_true", help="テストモード（注文を送信しない）"
     )
     args = parser.parse_args()
+    set_log_context(mode=args.mode)
+
+    lease = None
+    if args.mode in LEASED_MODES:
+        ttl = settings.get("coordinator", {}).get("lease_ttl_seconds", 120)
+        lease = RunLease(db, args.mode, ttl=ttl)
+        if not lease.acquire():
+            logger.warning(f"{args.mode} は別プロセスで実行中のためスキップします。")
+            return
+
+    try:
+        run_mode(args, db)
+    finally:
+        if lease:
+            lease.release()
+
+    logger.info(f"API呼び出しメトリクス: {get_api_metrics()}")
+    feed_stats = get_price_feed_stats()
+    if any(feed_stats.values()):
+        logger.info(f"価格フィード統計: {feed_stats}")
+
+
+def run_mode(args, db):
+    if args.mode == "dropcheck" and settings["add_purchase"].get("enabled", False):
+        add_symbols = [
+            symbol
+            for symbol, conf in settings["add_purchase"]["settings"].items()
+            if conf.get("jpy", 0) > 0
+        ]
+        backfill_price_history_gaps(db, add_symbols)
+        logger.info(f"HTTPキャッシュ統計: {get_cache_stats()}")
+
+    # 履歴補完・初期化はCoinGeckoの待機を含むため実行期限の対象外とする
+    if args.mode in TIME_BOUNDED_MODES:
+        http_client.set_run_deadline(
+            settings.get("resilience", {}).get("run_deadline_seconds")
+        )
 
     if args.mode == "basecheck" or args.mode == "dropcheck":
-        check_balance()
         symbols = list(settings["base_purchase"]["settings"].keys())
         current_prices = get_current_prices(symbols)
+        check_balance(db, current_prices)
 
     if args.mode == "basecheck":
         execute_base_purchase(current_prices, db, dry_run=args.dry_run)
@@ -164,12 +282,43 @@ def main():
             initialize_price_history_if_needed(
                 symbol, db, required_days=15, force=args.force
             )
+        logger.info(f"HTTPキャッシュ統計: {get_cache_stats()}")
     elif args.mode == "record-price":
         update_all_price_history(db)
     elif args.mode == "record-shortterm":
         save_all_short_term_prices(db)
     elif args.mode == "alertcheck":
         check_sudden_price_change(db)
+    elif args.mode == "export-history":
+        if export_history(db, args.path or os.path.join(DATA_DIR, "export")) is None:
+            sys.exit(1)
+    elif args.mode == "import-history":
+        if import_history(db, args.path or os.path.join(DATA_DIR, "export")) is None:
+            sys.exit(1)
+    elif args.mode == "archive":
+        hot_days = settings.get("archive", {}).get("hot_days", 90)
+        moved = db.archive_old_rows(hot_days)
+        for (month, table), count in sorted(moved.items()):
+            logger.info(f"{table} の {month} 分 {count}件をアーカイブへ移動しました")
+        if not moved:
+            logger.info("アーカイブ対象の履歴はありません。")
+        retention_days = settings.get("logging", {}).get("retention_days", 365)
+        cleanup_old_logs(LOG_DIR, retention_days)
+    elif args.mode == "backup":
+        dest = args.path or os.path.join(DATA_DIR, "backup")
+        copied = db.backup(dest)
+        if copied is None:
+            sys.exit(1)
+        logger.info(
+            f"バックアップ完了: {dest}（コピーしたアーカイブ: {', '.join(copied) or 'なし'}）"
+        )
+    elif args.mode == "serve":
+        dashboard_cfg = settings.get("dashboard", {})
+        serve_dashboard(
+            DATA_DIR,
+            host=dashboard_cfg.get("host", "127.0.0.1"),
+            port=dashboard_cfg.get("port", 8050),
+        )
 
 
 if __name__ == "__main__":
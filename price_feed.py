@@ -0,0 +1,284 @@
+# 価格フィード（複数ソースのヘッジ取得）
+# 主系（GMOコイン）の応答が遅い・失敗した場合に予備系へヘッジリクエストを送り、
+# 主系を優先して採用する。予備系が先に応答した場合も期限まで主系を待って乖離をチェックし、
+# 主系が応答しなければ直近の短期価格（reference）と照合してから予備系の価格を採用する。
+
+import abc
+import time
+import logging
+from decimal import Decimal
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from resilience import ResilientClient
+
+logger = logging.getLogger(__name__)
+
+# --- CoinGecko のコインID対応表 ---
+COINGECKO_IDS = {
+    "BTC": "bitcoin",
+    "ETH": "ethereum",
+    "BCH": "bitcoin-cash",
+    "LTC": "litecoin",
+    "XRP": "ripple",
+    "ADA": "cardano",
+    "DOT": "polkadot",
+    "SOL": "solana",
+    "LINK": "chainlink",
+    "DOGE": "dogecoin",
+}
+
+
+class PriceProvider(abc.ABC):
+    """現在価格の取得元。fetch() は失敗時に例外を送出する"""
+
+    name = "base"
+    # True の場合、複数通貨を fetch_many() の1リクエストで取得する
+    batched = False
+
+    def __init__(self, base_url=None, timeout=5, client=None):
+        self.base_url = base_url or self.default_base_url
+        self.timeout = timeout
+        self.client = client or ResilientClient()
+
+    # 遅延・失敗時の切り替えはヘッジ側で行うため再試行はしない
+    def _get(self, url, **kwargs):
+        resp = self.client.request(
+            "GET", url, timeout=self.timeout, max_attempts=1, **kwargs
+        )
+        resp.raise_for_status()
+        return resp.json()
+
+    @abc.abstractmethod
+    def fetch(self, symbol):
+        pass
+
+    # --- 複数通貨の価格（取得できなかった通貨は含めない） ---
+    def fetch_many(self, symbols):
+        return {symbol: self.fetch(symbol) for symbol in symbols}
+
+
+class GMOTickerProvider(PriceProvider):
+    name = "gmo"
+    default_base_url = "https://api.coin.z.com/public"
+
+    def fetch(self, symbol):
+        url = f"{self.base_url}/v1/ticker?symbol={symbol}_JPY"
+        data = self._get(url, gmo=True)
+        return Decimal(data["data"][0]["last"])
+
+
+class CoinGeckoSimpleProvider(PriceProvider):
+    name = "coingecko"
+    default_base_url = "https://api.coingecko.com/api/v3"
+    batched = True
+
+    def fetch(self, symbol):
+        prices = self.fetch_many([symbol])
+        if symbol not in prices:
+            raise ValueError(f"{symbol} の価格がCoinGeckoの応答にありません")
+        return prices[symbol]
+
+    # --- ids=a,b,c の1リクエストで全通貨を取得する ---
+    def fetch_many(self, symbols):
+        ids = {}
+        for symbol in symbols:
+            cg_id = COINGECKO_IDS.get(symbol.upper())
+            if not cg_id:
+                logger.warning(f"{symbol} はCoinGecko非対応です")
+                continue
+            ids[cg_id] = symbol
+        if not ids:
+            return {}
+        url = f"{self.base_url}/simple/price"
+        params = {"ids": ",".join(ids), "vs_currencies": "jpy"}
+        data = self._get(url, params=params)
+        return {
+            symbol: Decimal(str(data[cg_id]["jpy"]))
+            for cg_id, symbol in ids.items()
+            if "jpy" in data.get(cg_id, {})
+        }
+
+
+PROVIDERS = {
+    GMOTickerProvider.name: GMOTickerProvider,
+    CoinGeckoSimpleProvider.name: CoinGeckoSimpleProvider,
+}
+
+
+class HedgedPriceFeed:
+    def __init__(
+        self,
+        providers,
+        hedge_delay=1.0,
+        timeout=5.0,
+        max_divergence_percent=Decimal("3"),
+        reference=None,
+    ):
+        if not providers:
+            raise ValueError("価格取得元が1つも設定されていません")
+        self.providers = providers
+        self.hedge_delay = hedge_delay
+        self.timeout = timeout
+        self.max_divergence_percent = Decimal(str(max_divergence_percent))
+        # reference: 通貨リストを受け取り、照合用の価格（直近の短期価格）を返す関数
+        self.reference = reference
+        self.stats = {"primary": 0, "fallback": 0, "hedged": 0, "divergence": 0}
+
+    # --- 全通貨の現在価格を取得（取得できなかった通貨は含めない） ---
+    def get_prices(self, symbols):
+        symbols = list(symbols)
+        if not symbols:
+            return {}
+
+        pool = ThreadPoolExecutor(max_workers=len(symbols) * len(self.providers))
+        start = time.monotonic()
+        deadline = start + self.timeout
+        hedge_at = start + self.hedge_delay
+        hedged = False
+
+        pending = {}
+        results = {s: {} for s in symbols}
+        launched = {s: 0 for s in symbols}
+
+        # 次の取得元へ切り替える（一括取得できる取得元へは1リクエストにまとめる）
+        def launch(targets):
+            groups = {}
+            for symbol in targets:
+                idx = launched[symbol]
+                if idx < len(self.providers):
+                    launched[symbol] += 1
+                    groups.setdefault(idx, []).append(symbol)
+            for idx, group in groups.items():
+                provider = self.providers[idx]
+                batches = [group] if provider.batched else [[s] for s in group]
+                for batch in batches:
+                    future = pool.submit(provider.fetch_many, batch)
+                    pending[future] = (batch, idx)
+            return [s for group in groups.values() for s in group]
+
+        def in_flight(symbol, idx=None):
+            return any(
+                symbol in batch and (idx is None or i == idx)
+                for batch, i in pending.values()
+            )
+
+        # 予備系の価格だけが得られ、主系がまだ応答中の通貨は主系を待つ
+        def settled(symbol):
+            return bool(results[symbol]) and (
+                0 in results[symbol] or not in_flight(symbol, 0)
+            )
+
+        try:
+            launch(symbols)
+
+            while pending:
+                now = time.monotonic()
+                if now >= deadline:
+                    break
+                wake = deadline if hedged else min(deadline, hedge_at)
+                done, _ = wait(
+                    list(pending), timeout=wake - now, return_when=FIRST_COMPLETED
+                )
+
+                failed = []
+                for future in done:
+                    batch, idx = pending.pop(future)
+                    provider = self.providers[idx]
+                    try:
+                        prices = future.result()
+                    except Exception as e:
+                        prices = {}
+                        logger.warning(
+                            f"{','.join(batch)} 価格取得失敗（{provider.name}）: {e}"
+                        )
+                    for symbol in batch:
+                        if symbol in prices:
+                            results[symbol][idx] = prices[symbol]
+                        else:
+                            failed.append(symbol)
+                # 失敗時はヘッジ待ちをせず次の取得元へ切り替える
+                launch(s for s in failed if not results[s] and not in_flight(s))
+
+                if not hedged and time.monotonic() >= hedge_at:
+                    hedged = True
+                    for symbol in launch(s for s in symbols if not results[s]):
+                        self.stats["hedged"] += 1
+                        logger.info(
+                            f"{symbol} 主系の応答遅延のため予備系へヘッジします"
+                        )
+
+                if all(settled(s) for s in symbols):
+                    break
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+        # 予備系の価格しか得られなかった通貨は直近の短期価格と照合する
+        unconfirmed = [
+            s for s in symbols if len(results[s]) == 1 and 0 not in results[s]
+        ]
+        references = self._references(unconfirmed)
+
+        prices = {}
+        for symbol in symbols:
+            price = self._select(symbol, results[symbol], references.get(symbol))
+            if price is not None:
+                prices[symbol] = price
+        return prices
+
+    def _references(self, symbols):
+        if not symbols or self.reference is None:
+            return {}
+        try:
+            return self.reference(symbols)
+        except Exception as e:
+            logger.warning(f"照合用の短期価格の取得に失敗しました: {e}")
+            return {}
+
+    # --- 採用価格の決定（主系優先・複数の価格または照合価格との乖離チェック） ---
+    def _select(self, symbol, values, reference=None):
+        if not values:
+            logger.error(f"{symbol}価格取得エラー: すべての取得元で失敗しました")
+            return None
+
+        idx = min(values)
+        price = values[idx]
+        named = [(self.providers[i].name, v) for i, v in sorted(values.items())]
+        if len(values) == 1 and reference is not None:
+            named.append(("short_term_price", reference))
+        if len(named) > 1:
+            lo = min(v for _, v in named)
+            hi = max(v for _, v in named)
+            divergence = (hi - lo) / lo * Decimal("100")
+            if divergence > self.max_divergence_percent:
+                self.stats["divergence"] += 1
+                detail = ", ".join(f"{name}={v}" for name, v in named)
+                logger.error(
+                    f"{symbol} 価格の乖離が大きいため採用しません: "
+                    f"{divergence:.2f}% ({detail})"
+                )
+                return None
+
+        if idx == 0:
+            self.stats["primary"] += 1
+        else:
+            self.stats["fallback"] += 1
+            logger.warning(f"{symbol} 予備系（{self.providers[idx].name}）の価格を採用")
+        return price
+
+
+# --- 設定から価格フィードを構築 ---
+def build_price_feed(cfg=None, client=None, reference=None):
+    cfg = cfg or {}
+    timeout = cfg.get("timeout_seconds", 5)
+    base_urls = cfg.get("base_urls", {})
+    names = [cfg.get("primary", "gmo")] + cfg.get("backups", ["coingecko"])
+    providers = [
+        PROVIDERS[name](base_url=base_urls.get(name), timeout=timeout, client=client)
+        for name in names
+    ]
+    return HedgedPriceFeed(
+        providers,
+        hedge_delay=cfg.get("hedge_delay_seconds", 1.0),
+        timeout=timeout,
+        max_divergence_percent=cfg.get("max_divergence_percent", 3),
+        reference=reference,
+    )
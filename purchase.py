@@ -4,88 +4,44 @@ from decimal import Decimal, ROUND_DOWN
 from config import settings
 from notify import send_slack
 from api_client import place_order, get_executions_by_order
+from execution import (
+    execution_engine,
+    calculate_executed_price,
+    calculate_slippage,
+)
+from log_setup import log_symbols
+from coordinator import OWNER_ID
+from indicators import IndicatorEvaluator
+from account import account_service
+from resilience import NOT_SENT_ERRORS
 
 logger = logging.getLogger(__name__)
 
 
-# --- 平均価格の計算 ---
-def get_30day_average(symbol, db):
-    history = db.get_price_history(symbol, 30)
-    if not history:
-        return None
-    prices = [p for _, p in history]
-    return sum(prices) / len(prices)
-
-
-# --- RSIの計算 ---
-def calculate_rsi(symbol, db, period=14):
-    history = db.get_price_history(symbol, period + 1)
-    if len(history) < period + 1:
-        return None
-
-    gains, losses = [], []
-    for i in range(1, period + 1):
-        prev = history[i - 1][1]
-        curr = history[i][1]
-        diff = curr - prev
-        if diff > 0:
-            gains.append(diff)
-            losses.append(Decimal("0"))
-        else:
-            gains.append(Decimal("0"))
-            losses.append(-diff)
-
-    avg_gain = sum(gains) / Decimal(period)
-    avg_loss = sum(losses) / Decimal(period)
-
-    if avg_loss == 0:
-        return Decimal("100")
-
-    rs = avg_gain / avg_loss
-    rsi = Decimal("100") - (Decimal("100") / (Decimal("1") + rs))
-    return rsi.quantize(Decimal("0.01"))
-
-
-# --- 長期下落トレンド判定 ---
-def is_long_term_downtrend(symbol, db):
-    history = db.get_price_history(symbol, 37)
-    if len(history) < 37:
-        return False
-
-    prices_now = [p for _, p in history[-30:]]
-    prices_prev = [p for _, p in history[-37:-7]]
-
-    sma_now = sum(prices_now) / Decimal(30)
-    sma_prev = sum(prices_prev) / Decimal(30)
-
-    return sma_now < sma_prev
-
-
 # --- 購入結果処理 ---
 def handle_order_result(
     response, order_id, symbol, jpy, amount, current_price, purchase_type, db
 ):
     executed_price = None
     executed_time = None
+    slippage = None
 
-    if response.status_code == 200:
+    # GMOはエラー時もHTTP 200を返すため、注文IDの有無で成否を判定する
+    if response.status_code == 200 and order_id:
         # 約定情報取得を試みる
         if order_id:
             executions = get_executions_by_order(order_id)
             if executions:
                 try:
-                    total = sum(
-                        Decimal(e["price"]) * Decimal(e["size"]) for e in executions
-                    )
-                    size = sum(Decimal(e["size"]) for e in executions)
-                    executed_price = (total / size).quantize(Decimal("0.01"))
-                    executed_time = executions[0]["timestamp"]
+                    executed_price, executed_time = calculate_executed_price(executions)
+                    slippage = calculate_slippage(executed_price, current_price)
                 except Exception as e:
                     logger.warning(f"約定情報の計算失敗: {e}")
 
             if executed_price and executed_time:
                 log_msg = (
                     f"{symbol} 注文成功 / 数量: {amount} / 約定価格: {executed_price}円"
+                    f" / スリッページ: {slippage}%"
                 )
 
             else:
@@ -102,11 +58,75 @@ def handle_order_result(
             current_price,
             executed_price=executed_price,
             executed_time=executed_time,
+            slippage_percent=slippage,
+            order_slippage_percent=slippage,
         )
+        return True
     else:
         error_msg = f"{symbol}注文失敗: {response.status_code} {response.text}"
         logger.error(error_msg)
         send_slack(error_msg)
+        return False
+
+
+# --- 冪等キーを予約して注文する（同日・同種別の二重注文を防ぐ） ---
+def place_order_once(symbol, jpy, amount, current_price, purchase_type, db, conf=None):
+    # 残高不足で取引所に拒否される注文は送信しない
+    if not account_service.can_afford(db, jpy):
+        msg = f"{symbol} 残高不足のため{purchase_type}購入をスキップします（必要額: {jpy}円）"
+        logger.warning(msg)
+        send_slack(msg)
+        return
+
+    today = datetime.datetime.now().strftime("%Y-%m-%d")
+    key = db.reserve_purchase_key(symbol, purchase_type, today, OWNER_ID)
+    if key is None:
+        logger.warning(
+            f"{symbol} 本日の{purchase_type}購入は処理済みまたは処理中のためスキップ"
+        )
+        return
+    account_service.reserve(db, jpy)
+
+    # 分割注文の設定があればTWAPエンジンに委ねる（キーの完了もエンジン側で行う）
+    exec_cfg = (conf or {}).get("execution", {})
+    if exec_cfg.get("slices", 1) > 1:
+        min_unit = Decimal(str(conf["min_order_amount"]))
+        execution_engine.submit(
+            symbol,
+            jpy,
+            amount,
+            min_unit,
+            current_price,
+            purchase_type,
+            db,
+            exec_cfg,
+            key,
+        )
+        return
+
+    try:
+        response, order_id = place_order(symbol, amount)
+    except NOT_SENT_ERRORS as e:
+        # 取引所に届いていないため、キーを失敗にして再実行で注文できるようにする
+        msg = f"{symbol} 注文を送信できませんでした: {e}"
+        logger.error(msg)
+        send_slack(msg)
+        db.complete_purchase_key(key, "failed")
+        account_service.release(db, jpy)
+        return
+    except Exception as e:
+        # 送信後の通信エラーなどは約定有無が不明なため、キーはpendingのまま残す
+        msg = f"{symbol} 注文結果が不明です（約定状況を確認してください）: {e}"
+        logger.error(msg)
+        send_slack(msg)
+        return
+
+    ok = handle_order_result(
+        response, order_id, symbol, jpy, amount, current_price, purchase_type, db
+    )
+    db.complete_purchase_key(key, "done" if ok else "failed")
+    if not ok:
+        account_service.release(db, jpy)
 
 
 # --- 基本購入を実行する ---
@@ -118,7 +138,7 @@ def execute_base_purchase(current_prices, db, dry_run=False):
     now = datetime.datetime.now()
     logger.info("基本購入を開始します。")
 
-    for symbol, conf in settings["base_purchase"]["settings"].items():
+    for symbol, conf in log_symbols(settings["base_purchase"]["settings"].items()):
         jpy = conf["jpy"]
         interval_days = conf.get("interval_days", 2)
 
@@ -143,71 +163,15 @@ def execute_base_purchase(current_prices, db, dry_run=False):
                 send_slack(f"{symbol} テスト注文 / 数量: {amount}")
                 continue
 
-            response, order_id = place_order(symbol, amount)
-            handle_order_result(
-                response, order_id, symbol, jpy, amount, current_price, "base", db
-            )
+            place_order_once(symbol, jpy, amount, current_price, "base", db, conf)
         else:
             logger.info(f"{symbol} 基本購入スキップ（{interval_days}日未満）")
 
+    execution_engine.wait_all()
 
-# --- 購入スコアを計算する ---
-def calculate_purchase_score(
-    symbol, conf, current_price, last_price, avg_price, rsi, db
-):
-    score = 0
-    max_score = 3  # 前回比, SMA乖離, RSI の3項目
-    min_score = conf.get("min_score", 2)  # 購入判定に使われるしきい値
-    reasons = []
-
-    if last_price:
-        change = (current_price - last_price) / last_price * Decimal("100")
-        if change <= Decimal(conf.get("price_drop_percent", -3)):
-            score += 1
-            reasons.append(f"前回比 {change:.2f}% (+1)")
-        else:
-            reasons.append(f"前回比 {change:.2f}% (±0)")
-    else:
-        reasons.append("前回価格なし")
-
-    if avg_price:
-        sma_dev = (current_price - avg_price) / avg_price * Decimal("100")
-        passed = sma_dev <= Decimal(conf.get("sma_deviation", -5))
-        reasons.append(f"SMA乖離 {sma_dev:.2f}% ({'+1' if passed else '±0'})")
-        if passed:
-            score += 1
-
-    if rsi is not None:
-        threshold = Decimal(conf.get("rsi_threshold", 30))
-        passed = rsi <= threshold
-        reasons.append(f"RSI {rsi} ≤ {threshold} ({'+1' if passed else '±0'})")
-        if passed:
-            score += 1
-    else:
-        reasons.append("RSI未取得")
-
-    if is_long_term_downtrend(symbol, db):
-        score -= 1
-        reasons.append("長期トレンド悪化（-1）")
-    else:
-        reasons.append("長期トレンド良好（±0）")
-
-    reasons.insert(0, f"スコア={score}/{max_score}（条件:{min_score}以上）")
-
-    return score, reasons
 
-
-def evaluate_add_purchase(symbol, conf, current_price, db, dry_run=False):
-    today = datetime.datetime.now().strftime("%Y-%m-%d")
-    rows = db.get_purchase_history(symbol, limit=1, before_date=today)
-    last_price = Decimal(rows[0][3]) if rows else None
-
-    avg_price = get_30day_average(symbol, db)
-    rsi = calculate_rsi(symbol, db)
-
-    score, reasons = calculate_purchase_score(
-        symbol, conf, current_price, last_price, avg_price, rsi, db
-    )
+def evaluate_add_purchase(symbol, conf, current_price, evaluator):
+    score, reasons = evaluator.score(symbol, conf, current_price)
     should_buy = score >= conf.get("min_score", 2)
     return should_buy, reasons
 
@@ -230,8 +194,7 @@ def perform_add_purchase(symbol, conf, current_price, db, reasons, dry_run=False
         send_slack(order_msg, level=level)
         return
 
-    response = place_order(symbol, amount)
-    handle_order_result(response, symbol, jpy, amount, current_price, "add", db)
+    place_order_once(symbol, jpy, amount, current_price, "add", db, conf)
 
 
 def execute_add_purchase_flow(current_prices, db, dry_run=False):
@@ -240,8 +203,10 @@ def execute_add_purchase_flow(current_prices, db, dry_run=False):
         return
 
     logger.info("追加購入を実行します。")
+    # 全通貨の判定に必要な履歴をまとめて取得する
+    evaluator = IndicatorEvaluator(db, settings["add_purchase"]["settings"])
 
-    for symbol, conf in settings["add_purchase"]["settings"].items():
+    for symbol, conf in log_symbols(settings["add_purchase"]["settings"].items()):
         price = current_prices.get(symbol)
         if price is None:
             logger.info(f"{symbol} の価格取得に失敗したためスキップします。")
@@ -252,8 +217,10 @@ def execute_add_purchase_flow(current_prices, db, dry_run=False):
             logger.info(f"{symbol} は jpy=0 のためスキップされました。")
             continue
 
-        should_buy, reasons = evaluate_add_purchase(symbol, conf, price, db)
+        should_buy, reasons = evaluate_add_purchase(symbol, conf, price, evaluator)
         if should_buy:
             perform_add_purchase(symbol, conf, price, db, reasons, dry_run=dry_run)
         else:
             logger.info(f"{symbol} 追加購入条件を満たしません（{', '.join(reasons)}）")
+
+    execution_engine.wait_all()
@@ -0,0 +1,263 @@
+# API呼び出しの耐障害レイヤー
+# リトライ（指数バックオフ＋ジッター）・エンドポイント群単位のサーキットブレーカー・
+# 実行全体の期限（デッドライン）を一元管理する。
+
+import time
+import random
+import logging
+import threading
+from urllib.parse import urlparse
+import requests
+
+logger = logging.getLogger(__name__)
+
+# --- GMOコインのエラーコード分類 ---
+# 処理前に拒否されたことが明らかなもの（注文APIでも再送して二重発注にならない）
+RETRYABLE_GMO_CODES = {
+    "ERR-5003",  # APIの呼び出し回数上限
+    "ERR-5008",  # API-TIMESTAMPが遅い（再署名して再送）
+    "ERR-5009",  # API-TIMESTAMPが早い（再署名して再送）
+    "ERR-5201",  # 定期メンテナンス中
+    "ERR-5202",  # 緊急メンテナンス中
+    "ERR-5204",  # API利用不可
+}
+# 再送しても処理前に拒否されるHTTPステータス
+REJECTED_STATUS = {429, 503}
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+# --- リクエストが取引所に届いていないことが明らかな例外 ---
+# 非冪等な呼び出しで DeadlineExceeded となるのは、未送信または処理前の拒否の後のみ
+NOT_SENT_ERRORS = (
+    CircuitOpenError,
+    DeadlineExceeded,
+    requests.exceptions.ConnectTimeout,
+)
+
+
+# --- ブレーカーの単位（ホスト＋パス先頭。GMOコインは public / private を分ける） ---
+def endpoint_group(url):
+    parsed = urlparse(url)
+    segment = parsed.path.lstrip("/").split("/", 1)[0]
+    return f"{parsed.netloc}/{segment}" if segment else parsed.netloc
+
+
+class CircuitBreaker:
+    """連続失敗が閾値に達したらopenになり、reset_timeout経過後に1件だけ試行する"""
+
+    def __init__(self, group, failure_threshold=5, reset_timeout=60.0):
+        self.group = group
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == "open":
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    return False
+                self.state = "half_open"
+                return True
+            if self.state == "half_open":
+                # 試行中の1件の結果が出るまで他の呼び出しは通さない
+                return False
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                if self.state != "open":
+                    logger.warning(f"サーキットブレーカー open: {self.group}")
+                self.state = "open"
+                self.opened_at = time.monotonic()
+
+
+class ResilientClient:
+    def __init__(
+        self,
+        max_attempts=3,
+        base_delay=0.5,
+        max_delay=8.0,
+        failure_threshold=5,
+        reset_timeout=60.0,
+    ):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.deadline = None
+        self.breakers = {}
+        self.counters = {
+            "calls": 0,
+            "attempts": 0,
+            "retries": 0,
+            "failures": 0,
+            "short_circuited": 0,
+            "deadline_exceeded": 0,
+        }
+        self._lock = threading.Lock()
+
+    # --- 実行全体の期限を設定（Noneで無期限） ---
+    def set_run_deadline(self, seconds):
+        self.deadline = time.monotonic() + seconds if seconds else None
+
+    # --- 分割注文など後続の予定がある場合に期限を延長する ---
+    def extend_run_deadline(self, seconds):
+        if self.deadline is not None:
+            self.deadline += seconds
+
+    def remaining(self):
+        if self.deadline is None:
+            return None
+        return self.deadline - time.monotonic()
+
+    def _breaker(self, group):
+        with self._lock:
+            if group not in self.breakers:
+                self.breakers[group] = CircuitBreaker(
+                    group, self.failure_threshold, self.reset_timeout
+                )
+            return self.breakers[group]
+
+    def _count(self, key):
+        with self._lock:
+            self.counters[key] += 1
+
+    # --- リクエスト実行 ---
+    # prepare: 試行ごとに呼ばれ、署名付きヘッダなどの追加引数を返す
+    # idempotent=False の場合、処理前に拒否されたことが明らかな失敗のみ再送する
+    def request(
+        self,
+        method,
+        url,
+        prepare=None,
+        idempotent=True,
+        gmo=False,
+        timeout=5,
+        max_attempts=None,
+        **kwargs,
+    ):
+        breaker = self._breaker(endpoint_group(url))
+        attempts = max_attempts or self.max_attempts
+        self._count("calls")
+
+        for attempt in range(1, attempts + 1):
+            remaining = self.remaining()
+            if remaining is not None and remaining <= 0:
+                self._count("deadline_exceeded")
+                raise DeadlineExceeded(f"実行期限を超過しました: {url}")
+            if not breaker.allow():
+                self._count("short_circuited")
+                raise CircuitOpenError(f"サーキットブレーカー open: {breaker.group}")
+
+            call_timeout = timeout if remaining is None else min(timeout, remaining)
+            self._count("attempts")
+
+            try:
+                call_kwargs = dict(kwargs)
+                if prepare:
+                    call_kwargs.update(prepare())
+                resp = requests.request(
+                    method, url, timeout=call_timeout, **call_kwargs
+                )
+                error, retryable = self._classify(resp, idempotent, gmo)
+            except requests.exceptions.ConnectTimeout as e:
+                # 接続確立前のタイムアウトは未送信のため常に再送可能
+                error, retryable = e, True
+            except (requests.exceptions.ConnectionError, requests.Timeout) as e:
+                error, retryable = e, idempotent
+            except BaseException:
+                # 署名の失敗など想定外の例外も失敗として記録する（half_openのまま残さない）
+                breaker.record_failure()
+                self._count("failures")
+                raise
+            if error is None:
+                breaker.record_success()
+                return resp
+
+            breaker.record_failure()
+            self._count("failures")
+            if not retryable or attempt == attempts:
+                if isinstance(error, Exception):
+                    raise error
+                return resp
+
+            delay = self._backoff(attempt)
+            remaining = self.remaining()
+            if remaining is not None and delay >= remaining:
+                self._count("deadline_exceeded")
+                raise DeadlineExceeded(f"実行期限内に再試行できません: {url}")
+            logger.warning(
+                f"API呼び出し失敗のため再試行します（{attempt}/{attempts}）: "
+                f"{url} - {error}"
+            )
+            self._count("retries")
+            time.sleep(delay)
+
+    # --- レスポンスの判定（戻り値: エラー内容 or None, 再送可否） ---
+    def _classify(self, resp, idempotent, gmo):
+        if resp.status_code >= 500 or resp.status_code == 429:
+            retryable = idempotent or resp.status_code in REJECTED_STATUS
+            return f"HTTP {resp.status_code}", retryable
+        if not gmo or resp.status_code != 200:
+            return None, False
+
+        try:
+            data = resp.json()
+        except ValueError:
+            return None, False
+        if data.get("status", 0) == 0:
+            return None, False
+
+        codes = [m.get("message_code") for m in data.get("messages", [])]
+        if any(c in RETRYABLE_GMO_CODES for c in codes):
+            return f"GMOエラー {codes}", True
+        # 残高不足・パラメータ不正などは再送しても結果が変わらない（通信自体は成功）
+        return None, False
+
+    def _backoff(self, attempt):
+        cap = min(self.max_delay, self.base_delay * (2 ** (attempt - 1)))
+        return random.uniform(0, cap)
+
+    def metrics(self):
+        with self._lock:
+            breakers = {
+                group: {"state": b.state, "failures": b.failures}
+                for group, b in self.breakers.items()
+            }
+            result = dict(self.counters)
+        result["breakers"] = breakers
+        remaining = self.remaining()
+        if remaining is not None:
+            result["deadline_remaining"] = round(remaining, 1)
+        return result
+
+
+# --- 設定から生成 ---
+def build_client(cfg=None):
+    cfg = cfg or {}
+    return ResilientClient(
+        max_attempts=cfg.get("max_attempts", 3),
+        base_delay=cfg.get("base_delay_seconds", 0.5),
+        max_delay=cfg.get("max_delay_seconds", 8.0),
+        failure_threshold=cfg.get("failure_threshold", 5),
+        reset_timeout=cfg.get("reset_timeout_seconds", 60.0),
+    )
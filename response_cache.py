@@ -0,0 +1,130 @@
+# HTTPレスポンスキャッシュ（SQLite）
+# 過去日の価格など不変なレスポンスを永続化し、再取得時のネットワークアクセスを省く。
+
+import os
+import time
+import sqlite3
+import logging
+from db_manager import handle_db_error
+
+logger = logging.getLogger(__name__)
+
+CACHE_FILENAME = "http_cache.db"
+
+
+class ResponseCache:
+    def __init__(self, data_dir, max_bytes=10_000_000):
+        self.db_path = os.path.join(data_dir, CACHE_FILENAME)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._initialized = False
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path)
+        if not self._initialized:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS http_cache (
+                    key TEXT PRIMARY KEY,
+                    body TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL,
+                    expires_at REAL
+                )
+                """
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_http_cache_accessed "
+                "ON http_cache (accessed_at)"
+            )
+            conn.commit()
+            self._initialized = True
+        return conn
+
+    # --- キャッシュ参照（期限切れは削除してミス扱い） ---
+    def get(self, key):
+        now = time.time()
+        conn = None
+        try:
+            conn = self._connect()
+            cur = conn.cursor()
+            cur.execute("SELECT body, expires_at FROM http_cache WHERE key = ?", (key,))
+            row = cur.fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            if row[1] is not None and row[1] <= now:
+                cur.execute("DELETE FROM http_cache WHERE key = ?", (key,))
+                conn.commit()
+                self.misses += 1
+                return None
+
+            cur.execute(
+                "UPDATE http_cache SET accessed_at = ? WHERE key = ?", (now, key)
+            )
+            conn.commit()
+            self.hits += 1
+            return row[0]
+        except Exception as e:
+            handle_db_error(e, context="HTTPキャッシュ参照処理")
+            self.misses += 1
+            return None
+        finally:
+            if conn:
+                conn.close()
+
+    # --- キャッシュ登録（ttl=Noneは無期限）、上限超過分はLRUで削除 ---
+    def put(self, key, body, ttl=None):
+        now = time.time()
+        expires_at = now + ttl if ttl is not None else None
+        size = len(body.encode("utf-8"))
+        conn = None
+        try:
+            conn = self._connect()
+            cur = conn.cursor()
+            cur.execute(
+                """
+                INSERT OR REPLACE INTO http_cache
+                    (key, body, size, created_at, accessed_at, expires_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                (key, body, size, now, now, expires_at),
+            )
+            self._evict(cur, now)
+            conn.commit()
+        except Exception as e:
+            handle_db_error(e, context="HTTPキャッシュ登録処理")
+        finally:
+            if conn:
+                conn.close()
+
+    def _evict(self, cur, now):
+        cur.execute(
+            "DELETE FROM http_cache WHERE expires_at IS NOT NULL AND expires_at <= ?",
+            (now,),
+        )
+        cur.execute("SELECT COALESCE(SUM(size), 0) FROM http_cache")
+        total = cur.fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        # 最終参照が古い順に、合計サイズが上限内に収まるまで削除する
+        cur.execute("SELECT key, size FROM http_cache ORDER BY accessed_at")
+        victims = []
+        for key, size in cur.fetchall():
+            if total <= self.max_bytes:
+                break
+            victims.append((key,))
+            total -= size
+        cur.executemany("DELETE FROM http_cache WHERE key = ?", victims)
+        logger.info(f"HTTPキャッシュを {len(victims)} 件削除しました（LRU）")
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
@@ -0,0 +1,231 @@
+# 固定小数点版の指標・スコア・加重平均約定価格が
+# 従来のDecimal版と同じ結果になることを確認するテスト
+
+import random
+import datetime
+from decimal import Decimal
+
+import pytest
+
+import fixed_point as fp
+from db_manager import DBManager
+from indicators import IndicatorEvaluator
+from execution import calculate_executed_price
+
+SYMBOL = "BTC"
+CONF = {
+    "jpy": 1000,
+    "min_score": 2,
+    "min_order_amount": 0.00001,
+    "price_drop_percent": -3,
+    "sma_deviation": -5,
+    "rsi_threshold": 30,
+}
+
+
+# --- 従来のDecimal版の実装（purchase.py から移植） ---
+def old_30day_average(prices):
+    window = prices[-30:]
+    if not window:
+        return None
+    return sum(window) / len(window)
+
+
+def old_rsi(prices, period=14):
+    history = prices[-(period + 1) :]
+    if len(history) < period + 1:
+        return None
+    gains, losses = [], []
+    for prev, curr in zip(history, history[1:]):
+        diff = curr - prev
+        if diff > 0:
+            gains.append(diff)
+            losses.append(Decimal("0"))
+        else:
+            gains.append(Decimal("0"))
+            losses.append(-diff)
+    avg_gain = sum(gains) / Decimal(period)
+    avg_loss = sum(losses) / Decimal(period)
+    if avg_loss == 0:
+        return Decimal("100")
+    rs = avg_gain / avg_loss
+    rsi = Decimal("100") - (Decimal("100") / (Decimal("1") + rs))
+    return rsi.quantize(Decimal("0.01"))
+
+
+def old_long_term_downtrend(prices):
+    if len(prices) < 37:
+        return False
+    sma_now = sum(prices[-30:]) / Decimal(30)
+    sma_prev = sum(prices[-37:-7]) / Decimal(30)
+    return sma_now < sma_prev
+
+
+def old_score(conf, current_price, last_price, prices):
+    score = 0
+    max_score = 3
+    min_score = conf.get("min_score", 2)
+    reasons = []
+
+    if last_price:
+        change = (current_price - last_price) / last_price * Decimal("100")
+        if change <= Decimal(conf.get("price_drop_percent", -3)):
+            score += 1
+            reasons.append(f"前回比 {change:.2f}% (+1)")
+        else:
+            reasons.append(f"前回比 {change:.2f}% (±0)")
+    else:
+        reasons.append("前回価格なし")
+
+    avg_price = old_30day_average(prices)
+    if avg_price:
+        sma_dev = (current_price - avg_price) / avg_price * Decimal("100")
+        passed = sma_dev <= Decimal(conf.get("sma_deviation", -5))
+        reasons.append(f"SMA乖離 {sma_dev:.2f}% ({'+1' if passed else '±0'})")
+        if passed:
+            score += 1
+
+    rsi = old_rsi(prices)
+    if rsi is not None:
+        threshold = Decimal(conf.get("rsi_threshold", 30))
+        passed = rsi <= threshold
+        reasons.append(f"RSI {rsi} ≤ {threshold} ({'+1' if passed else '±0'})")
+        if passed:
+            score += 1
+    else:
+        reasons.append("RSI未取得")
+
+    if old_long_term_downtrend(prices):
+        score -= 1
+        reasons.append("長期トレンド悪化（-1）")
+    else:
+        reasons.append("長期トレンド良好（±0）")
+
+    reasons.insert(0, f"スコア={score}/{max_score}（条件:{min_score}以上）")
+    return score, reasons
+
+
+def old_executed_price(executions):
+    total = sum(Decimal(e["price"]) * Decimal(e["size"]) for e in executions)
+    size = sum(Decimal(e["size"]) for e in executions)
+    return (total / size).quantize(Decimal("0.01"))
+
+
+# --- テスト用の価格系列 ---
+def random_walk(rng, days, start="5000000", decimals=0):
+    price = Decimal(start)
+    step = Decimal(1).scaleb(-decimals)
+    prices = []
+    for _ in range(days):
+        change = Decimal(str(rng.uniform(-0.05, 0.05)))
+        price = max((price * (1 + change)).quantize(step), step)
+        prices.append(price)
+    return prices
+
+
+FIXED_HISTORIES = [
+    [Decimal("100")] * 40,
+    [Decimal(100 + i) for i in range(40)],
+    [Decimal(140 - i) for i in range(40)],
+    [Decimal(str(v)) for v in ("0.25", "0.2501", "0.2499", "0.31", "0.12345678")] * 8,
+    [Decimal("5000000"), Decimal("4800000")] * 20,
+    [Decimal(100 + i) for i in range(10)],
+    [],
+]
+
+
+def random_histories(count):
+    rng = random.Random(20261019)
+    histories = []
+    for i in range(count):
+        days = rng.choice([15, 30, 37, 40, 60])
+        decimals = rng.choice([0, 3, 8])
+        start = rng.choice(["5000000", "350000", "0.5"])
+        histories.append(random_walk(rng, days, start, decimals))
+    return histories
+
+
+def make_db(tmp_path, prices, last_price=None):
+    db = DBManager(str(tmp_path))
+    db.ensure_initialized()
+    start = datetime.date.today() - datetime.timedelta(days=len(prices))
+    db.record_price_histories(
+        [
+            (SYMBOL, p, (start + datetime.timedelta(days=i)).isoformat())
+            for i, p in enumerate(prices)
+        ]
+    )
+    if last_price is not None:
+        yesterday = datetime.date.today() - datetime.timedelta(days=1)
+        db.record_purchase_histories(
+            [
+                {
+                    "symbol": SYMBOL,
+                    "jpy_amount": 1000,
+                    "crypto_amount": "0.001",
+                    "purchase_type": "base",
+                    "current_price": last_price,
+                    "date": f"{yesterday} 09:00:00",
+                }
+            ]
+        )
+    return db
+
+
+HISTORIES = FIXED_HISTORIES + random_histories(50)
+
+
+@pytest.mark.parametrize("prices", HISTORIES)
+def test_indicators_match_decimal(prices):
+    closes = [fp.to_fixed(p) for p in prices]
+
+    average = old_30day_average(prices)
+    if average is None:
+        assert closes[-30:] == []
+    else:
+        window = closes[-30:]
+        assert fp.to_decimal(fp.div_round(sum(window), len(window))) == (
+            average.quantize(Decimal("1E-8"))
+        )
+
+    expected = old_rsi(prices)
+    if expected is None:
+        assert len(closes) < 15
+    else:
+        value = fp.rsi_from_moves(*fp.gains_losses(closes, 14))
+        assert Decimal(value).scaleb(-2) == expected
+
+    if len(closes) >= 37:
+        down = sum(closes[-30:]) < sum(closes[-37:-7])
+        assert down == old_long_term_downtrend(prices)
+
+
+@pytest.mark.parametrize("index", range(len(HISTORIES)))
+def test_score_matches_decimal(tmp_path, index):
+    prices = HISTORIES[index]
+    rng = random.Random(index)
+    base = prices[-1] if prices else Decimal("100")
+    current = (base * Decimal(str(rng.uniform(0.9, 1.05)))).quantize(Decimal("0.01"))
+    last_price = None if index % 3 == 0 else base * Decimal("1.04")
+
+    db = make_db(tmp_path, prices, last_price)
+    evaluator = IndicatorEvaluator(db, {SYMBOL: CONF})
+    assert evaluator.score(SYMBOL, CONF, current) == old_score(
+        CONF, current, last_price, prices
+    )
+
+
+def test_executed_price_matches_decimal():
+    rng = random.Random(36)
+    for _ in range(200):
+        executions = [
+            {
+                "price": str(Decimal(rng.randint(1, 10**9)).scaleb(-rng.randint(0, 3))),
+                "size": str(Decimal(rng.randint(1, 10**6)).scaleb(-rng.randint(0, 8))),
+                "timestamp": "2026-10-19T00:00:00.000Z",
+            }
+            for _ in range(rng.randint(1, 5))
+        ]
+        executed_price, executed_time = calculate_executed_price(executions)
+        assert executed_price == old_executed_price(executions)
+        assert executed_time == executions[0]["timestamp"]
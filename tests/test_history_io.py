@@ -0,0 +1,84 @@
+# 履歴のエクスポート→インポートで、保存されている文字列がそのまま再現されることを確認するテスト
+
+import sqlite3
+import struct
+
+from db_manager import DBManager, TABLE_COLUMNS
+from history_io import export_history, import_history, _read_npy_header
+
+PRICES = ["23.456789123456", "9876543.210987654", "5000000", "0.0200", "1e-05", "100"]
+
+
+def make_db(path):
+    path.mkdir()
+    db = DBManager(str(path))
+    db.ensure_initialized()
+    return db
+
+
+def dump(db, table):
+    columns = ", ".join(TABLE_COLUMNS[table])
+    with sqlite3.connect(db.db_path) as conn:
+        return conn.execute(
+            f"SELECT {columns} FROM {table} ORDER BY {columns}"
+        ).fetchall()
+
+
+def test_round_trip_keeps_stored_text(tmp_path):
+    src = make_db(tmp_path / "src")
+    src.record_price_histories(
+        [("BTC", p, f"2026-10-{i + 1:02d}") for i, p in enumerate(PRICES)]
+    )
+    src.record_short_term_prices(
+        [("ETH", p, f"2026-10-19 09:{i:02d}:00") for i, p in enumerate(PRICES)]
+    )
+    src.record_purchase_histories(
+        [
+            {
+                "symbol": "BTC",
+                "jpy_amount": 1000,
+                "crypto_amount": "0.000101234567891",
+                "purchase_type": "base",
+                "current_price": "9876543.210987654",
+                "date": "2026-10-18 09:00:00",
+            },
+            {
+                "symbol": "BTC",
+                "jpy_amount": "1000.5",
+                "crypto_amount": "0.0002",
+                "purchase_type": "twap",
+                "current_price": "5000000",
+                "executed_price": "5001000.12",
+                "executed_time": "2026-10-18T09:00:01.000Z",
+                "order_group": "g1",
+                "slice_index": 2,
+                "slippage_percent": "0.0200",
+                "date": "2026-10-18 09:05:00",
+            },
+        ]
+    )
+
+    out = tmp_path / "export"
+    manifest = export_history(src, str(out))
+    assert manifest["tables"]["price_history"]["columns"]["price"]["dtype"] == "<i8"
+
+    dst = make_db(tmp_path / "dst")
+    assert import_history(dst, str(out)) == {
+        "price_history": len(PRICES),
+        "short_term_price": len(PRICES),
+        "purchase_history": 2,
+    }
+    for table in TABLE_COLUMNS:
+        assert dump(dst, table) == dump(src, table)
+
+
+def test_numeric_columns_are_scaled_int64(tmp_path):
+    src = make_db(tmp_path / "src")
+    src.record_price_histories([("BTC", "5000000.5", "2026-10-01")])
+    out = tmp_path / "export"
+    export_history(src, str(out))
+
+    data = (out / "price_history" / "price.npy").read_bytes()
+    offset, descr, count = _read_npy_header(data)
+    assert (descr, count) == ("<i8", 1)
+    assert struct.unpack_from("<q", data, offset) == (500000050000000,)
@@ -0,0 +1,129 @@
+# 価格フィードのヘッジ・乖離チェックを、ローカルのスタブサーバーに対して確認するテスト
+
+import json
+import time
+import threading
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import pytest
+
+from price_feed import build_price_feed
+from resilience import ResilientClient
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    # 取得元ごとの応答: {"price": 価格, "delay": 秒, "status": HTTPステータス}
+    routes = {}
+    calls = []
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        source = url.path.split("/")[1]
+        self.calls.append((source, parse_qs(url.query)))
+        route = self.routes[source]
+        time.sleep(route.get("delay", 0))
+        status = route.get("status", 200)
+        if source == "gmo":
+            body = {"status": 0, "data": [{"last": str(route.get("price"))}]}
+        else:
+            ids = parse_qs(url.query)["ids"][0].split(",")
+            body = {cg_id: {"jpy": route.get("price")} for cg_id in ids}
+        data = json.dumps(body).encode()
+        try:
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        except OSError:
+            pass  # クライアントがタイムアウトで切断済み
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub():
+    StubHandler.routes = {}
+    StubHandler.calls = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def make_feed(server, gmo, coingecko, reference=None, timeout=1.5):
+    StubHandler.routes = {"gmo": gmo, "coingecko": coingecko}
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    cfg = {
+        "primary": "gmo",
+        "backups": ["coingecko"],
+        "hedge_delay_seconds": 0.2,
+        "timeout_seconds": timeout,
+        "max_divergence_percent": 3,
+        "base_urls": {"gmo": f"{base}/gmo", "coingecko": f"{base}/coingecko"},
+    }
+    return build_price_feed(
+        cfg, client=ResilientClient(max_attempts=1), reference=reference
+    )
+
+
+def sources():
+    return [source for source, _ in StubHandler.calls]
+
+
+def test_primary_fast(stub):
+    feed = make_feed(stub, {"price": 100}, {"price": 101})
+    assert feed.get_prices(["BTC", "ETH"]) == {
+        "BTC": Decimal("100"),
+        "ETH": Decimal("100"),
+    }
+    assert sources() == ["gmo", "gmo"]
+    assert feed.stats == {"primary": 2, "fallback": 0, "hedged": 0, "divergence": 0}
+
+
+def test_primary_slow_is_hedged_and_still_preferred(stub):
+    feed = make_feed(stub, {"price": 100, "delay": 0.6}, {"price": 101})
+    assert feed.get_prices(["BTC", "ETH"]) == {
+        "BTC": Decimal("100"),
+        "ETH": Decimal("100"),
+    }
+    # 予備系へは1リクエストにまとめてヘッジする
+    backup = [q for source, q in StubHandler.calls if source == "coingecko"]
+    assert [q["ids"][0].split(",") for q in backup] == [["bitcoin", "ethereum"]]
+    assert feed.stats == {"primary": 2, "fallback": 0, "hedged": 2, "divergence": 0}
+
+
+def test_primary_fails_backup_checked_against_reference(stub):
+    feed = make_feed(
+        stub,
+        {"status": 500},
+        {"price": 101},
+        reference=lambda symbols: {s: Decimal("100") for s in symbols},
+    )
+    assert feed.get_prices(["BTC"]) == {"BTC": Decimal("101")}
+    assert feed.stats["fallback"] == 1
+
+
+def test_divergent_backup_is_rejected_when_primary_answers_late(stub):
+    feed = make_feed(stub, {"price": 100, "delay": 0.6}, {"price": 200})
+    assert feed.get_prices(["BTC"]) == {}
+    assert feed.stats["hedged"] == 1
+    assert feed.stats["divergence"] == 1
+
+
+def test_divergent_backup_is_rejected_by_reference_when_primary_times_out(stub):
+    feed = make_feed(
+        stub,
+        {"price": 100, "delay": 2},
+        {"price": 200},
+        reference=lambda symbols: {s: Decimal("100") for s in symbols},
+        timeout=0.8,
+    )
+    assert feed.get_prices(["BTC"]) == {}
+    assert feed.stats["divergence"] == 1
@@ -0,0 +1,184 @@
+# 購入キー（同日・同種別の二重注文防止）と実行リースを、一時DBに対して確認するテスト
+
+import sqlite3
+import datetime
+
+import pytest
+import requests
+
+import db_manager
+import purchase
+from db_manager import DBManager
+from resilience import CircuitOpenError, DeadlineExceeded
+
+DATE = "2026-10-19"
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = DBManager(str(tmp_path))
+    db.ensure_initialized()
+    return db
+
+
+def key_status(db, key):
+    with sqlite3.connect(db.db_path) as conn:
+        row = conn.execute(
+            "SELECT status FROM purchase_key WHERE key = ?", (key,)
+        ).fetchone()
+    return row[0] if row else None
+
+
+# --- 購入キー ---
+def test_second_reservation_rejected_while_pending(db):
+    key = db.reserve_purchase_key("BTC", "base", DATE, "a")
+    assert key == f"BTC:base:{DATE}"
+    assert db.reserve_purchase_key("BTC", "base", DATE, "a") is None
+    assert db.reserve_purchase_key("BTC", "base", DATE, "b") is None
+    assert key_status(db, key) == "pending"
+
+
+def test_second_reservation_rejected_when_done(db):
+    key = db.reserve_purchase_key("BTC", "base", DATE, "a")
+    db.complete_purchase_key(key, "done")
+    assert db.reserve_purchase_key("BTC", "base", DATE, "b") is None
+    assert key_status(db, key) == "done"
+
+
+def test_failed_key_can_be_reserved_again(db):
+    key = db.reserve_purchase_key("BTC", "base", DATE, "a")
+    db.complete_purchase_key(key, "failed")
+    assert db.reserve_purchase_key("BTC", "base", DATE, "b") == key
+    assert key_status(db, key) == "pending"
+    assert db.reserve_purchase_key("BTC", "base", DATE, "c") is None
+
+
+def test_keys_are_per_symbol_type_and_date(db):
+    assert db.reserve_purchase_key("BTC", "base", DATE, "a")
+    assert db.reserve_purchase_key("ETH", "base", DATE, "a")
+    assert db.reserve_purchase_key("BTC", "extra", DATE, "a")
+    assert db.reserve_purchase_key("BTC", "base", "2026-10-20", "a")
+
+
+# --- 実行リース ---
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(db_manager.time, "time", lambda: now[0])
+    return now
+
+
+def test_lease_blocked_for_other_owner_until_expiry(db, clock):
+    assert db.acquire_lease("daily", "a", 60) is True
+    assert db.acquire_lease("daily", "b", 60) is False
+    # 自身のリースは再取得できる
+    assert db.acquire_lease("daily", "a", 60) is True
+
+    clock[0] += 59
+    assert db.acquire_lease("daily", "b", 60) is False
+    clock[0] += 2
+    assert db.acquire_lease("daily", "b", 60) is True
+    assert db.acquire_lease("daily", "a", 60) is False
+
+
+def test_lease_renewal_extends_expiry(db, clock):
+    assert db.acquire_lease("daily", "a", 60)
+    clock[0] += 50
+    assert db.renew_lease("daily", "a", 60) is True
+    assert db.renew_lease("daily", "b", 60) is False
+    clock[0] += 50
+    assert db.acquire_lease("daily", "b", 60) is False
+
+
+def test_lease_release_only_by_owner(db, clock):
+    assert db.acquire_lease("daily", "a", 60)
+    db.release_lease("daily", "b")
+    assert db.acquire_lease("daily", "b", 60) is False
+    db.release_lease("daily", "a")
+    assert db.acquire_lease("daily", "b", 60) is True
+    # 別モードのリースは独立している
+    assert db.acquire_lease("hourly", "a", 60) is True
+
+
+# --- 注文送信時の購入キーの扱い ---
+class FakeAccount:
+    def __init__(self):
+        self.reserved = []
+        self.released = []
+
+    def can_afford(self, db, jpy):
+        return True
+
+    def reserve(self, db, jpy):
+        self.reserved.append(jpy)
+
+    def release(self, db, jpy):
+        self.released.append(jpy)
+
+
+@pytest.fixture
+def account(monkeypatch):
+    account = FakeAccount()
+    monkeypatch.setattr(purchase, "account_service", account)
+    monkeypatch.setattr(purchase, "send_slack", lambda *args, **kwargs: None)
+    return account
+
+
+def order_with(monkeypatch, db, outcome):
+    def place_order(symbol, amount):
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    monkeypatch.setattr(purchase, "place_order", place_order)
+    purchase.place_order_once("BTC", 1000, "0.0002", "5000000", "base", db)
+    today = datetime.datetime.now().strftime("%Y-%m-%d")
+    return f"BTC:base:{today}"
+
+
+@pytest.mark.parametrize(
+    "error",
+    [
+        requests.exceptions.ConnectTimeout("connect timeout"),
+        CircuitOpenError("open"),
+        DeadlineExceeded("deadline"),
+    ],
+)
+def test_not_sent_error_marks_key_failed(monkeypatch, db, account, error):
+    key = order_with(monkeypatch, db, error)
+    assert key_status(db, key) == "failed"
+    assert account.reserved == [1000] and account.released == [1000]
+    # 再実行で注文し直せる
+    assert db.reserve_purchase_key("BTC", "base", key.split(":")[2], "b") == key
+
+
+@pytest.mark.parametrize(
+    "error",
+    [
+        requests.exceptions.ReadTimeout("read timeout"),
+        requests.exceptions.ConnectionError("reset"),
+        ValueError("invalid json"),
+    ],
+)
+def test_unknown_outcome_leaves_key_pending(monkeypatch, db, account, error):
+    key = order_with(monkeypatch, db, error)
+    assert key_status(db, key) == "pending"
+    assert account.released == []
+    # 約定状況を確認するまで再注文しない
+    assert db.reserve_purchase_key("BTC", "base", key.split(":")[2], "b") is None
+
+
+@pytest.mark.parametrize("ok, status", [(True, "done"), (False, "failed")])
+def test_order_result_completes_key(monkeypatch, db, account, ok, status):
+    monkeypatch.setattr(purchase, "handle_order_result", lambda *args: ok)
+    key = order_with(monkeypatch, db, (object(), "123"))
+    assert key_status(db, key) == status
+    assert account.released == ([] if ok else [1000])
+
+
+def test_duplicate_order_skipped_without_sending(monkeypatch, db, account):
+    monkeypatch.setattr(purchase, "handle_order_result", lambda *args: True)
+    order_with(monkeypatch, db, (object(), "123"))
+    key = order_with(monkeypatch, db, AssertionError("二重送信"))
+    assert key_status(db, key) == "done"
+    assert account.reserved == [1000]
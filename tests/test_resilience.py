@@ -0,0 +1,266 @@
+# 注文の再送可否・サーキットブレーカー・実行期限の判定を、requests をスタブに
+# 差し替えて確認するテスト（判定を誤ると二重発注になるため網羅的に確認する）
+
+import pytest
+import requests
+
+import resilience
+from resilience import (
+    ResilientClient,
+    CircuitOpenError,
+    DeadlineExceeded,
+    NOT_SENT_ERRORS,
+)
+
+ORDER_URL = "https://api.coin.z.com/private/v1/order"
+TICKER_URL = "https://api.coin.z.com/public/v1/ticker"
+
+
+class FakeResponse:
+    def __init__(self, status_code=200, body=None):
+        self.status_code = status_code
+        self.body = body if body is not None else {"status": 0, "data": "1"}
+
+    def json(self):
+        return self.body
+
+
+def gmo_error(code):
+    return FakeResponse(200, {"status": 1, "messages": [{"message_code": code}]})
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(resilience.time, "monotonic", clock.monotonic)
+    monkeypatch.setattr(resilience.time, "sleep", clock.sleep)
+    return clock
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    """requests.request を、与えた応答・例外を順に返すスタブに差し替える"""
+    calls = []
+    outcomes = []
+
+    def request(method, url, **kwargs):
+        calls.append((method, url))
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    monkeypatch.setattr(resilience.requests, "request", request)
+
+    def set_outcomes(*items):
+        outcomes[:] = list(items)
+        return calls
+
+    return set_outcomes
+
+
+def order(client):
+    return client.request(
+        "POST", ORDER_URL, idempotent=False, gmo=True, timeout=5, data="{}"
+    )
+
+
+def new_client(**kwargs):
+    kwargs.setdefault("max_attempts", 3)
+    kwargs.setdefault("failure_threshold", 100)
+    return ResilientClient(**kwargs)
+
+
+# --- 注文（非冪等）の再送可否 ---
+@pytest.mark.parametrize(
+    "first",
+    [
+        FakeResponse(429),
+        FakeResponse(503),
+        gmo_error("ERR-5003"),
+        gmo_error("ERR-5008"),
+        gmo_error("ERR-5009"),
+        gmo_error("ERR-5201"),
+        gmo_error("ERR-5202"),
+        gmo_error("ERR-5204"),
+        requests.exceptions.ConnectTimeout("connect timeout"),
+    ],
+)
+def test_order_resent_only_when_rejected_before_processing(clock, stub, first):
+    calls = stub(first, FakeResponse())
+    resp = order(new_client())
+    assert resp.status_code == 200 and resp.body["status"] == 0
+    assert len(calls) == 2
+
+
+@pytest.mark.parametrize("status", [500, 502, 504])
+def test_order_not_resent_on_server_error(clock, stub, status):
+    calls = stub(FakeResponse(status), FakeResponse())
+    assert order(new_client()).status_code == status
+    assert len(calls) == 1
+
+
+@pytest.mark.parametrize(
+    "error",
+    [
+        requests.exceptions.ReadTimeout("read timeout"),
+        requests.exceptions.ConnectionError("reset"),
+    ],
+)
+def test_order_not_resent_after_possible_send(clock, stub, error):
+    calls = stub(error, FakeResponse())
+    with pytest.raises(type(error)):
+        order(new_client())
+    assert len(calls) == 1
+    # 取引所に届いた可能性があるため、未送信としては扱わない
+    assert not isinstance(error, NOT_SENT_ERRORS)
+
+
+@pytest.mark.parametrize("code", ["ERR-201", "ERR-5106", "ERR-5122"])
+def test_order_not_resent_on_business_error(clock, stub, code):
+    calls = stub(gmo_error(code), FakeResponse())
+    assert order(new_client()).body["messages"][0]["message_code"] == code
+    assert len(calls) == 1
+
+
+def test_order_gives_up_after_max_attempts(clock, stub):
+    calls = stub(FakeResponse(503), FakeResponse(503), FakeResponse(503))
+    assert order(new_client(max_attempts=3)).status_code == 503
+    assert len(calls) == 3
+
+
+def test_idempotent_get_retries_read_timeout_and_server_error(clock, stub):
+    calls = stub(
+        requests.exceptions.ReadTimeout("read timeout"),
+        FakeResponse(500),
+        FakeResponse(),
+    )
+    assert new_client().request("GET", TICKER_URL).status_code == 200
+    assert len(calls) == 3
+
+
+def test_not_sent_errors():
+    assert isinstance(requests.exceptions.ConnectTimeout(), NOT_SENT_ERRORS)
+    assert isinstance(CircuitOpenError(), NOT_SENT_ERRORS)
+    assert isinstance(DeadlineExceeded(), NOT_SENT_ERRORS)
+    assert not isinstance(requests.exceptions.ReadTimeout(), NOT_SENT_ERRORS)
+
+
+# --- サーキットブレーカー ---
+def open_breaker(client, stub):
+    stub(FakeResponse(500), FakeResponse(500))
+    for _ in range(2):
+        client.request("GET", ORDER_URL, max_attempts=1)
+    return client.breakers["api.coin.z.com/private"]
+
+
+def test_breaker_opens_and_short_circuits(clock, stub):
+    client = new_client(failure_threshold=2, reset_timeout=60)
+    breaker = open_breaker(client, stub)
+    assert breaker.state == "open"
+
+    calls = stub(FakeResponse())
+    with pytest.raises(CircuitOpenError):
+        order(client)
+    assert calls == [("GET", ORDER_URL)] * 2  # 新たな送信はない
+    # public は別のブレーカー
+    stub(FakeResponse())
+    assert client.request("GET", TICKER_URL).status_code == 200
+
+
+def test_breaker_half_open_success_closes(clock, stub):
+    client = new_client(failure_threshold=2, reset_timeout=60)
+    breaker = open_breaker(client, stub)
+    clock.now += 61
+
+    stub(FakeResponse())
+    assert client.request("GET", ORDER_URL).status_code == 200
+    assert breaker.state == "closed" and breaker.failures == 0
+
+
+def test_breaker_half_open_failure_reopens(clock, stub):
+    client = new_client(failure_threshold=2, reset_timeout=60)
+    breaker = open_breaker(client, stub)
+    clock.now += 61
+
+    calls = stub(FakeResponse(500), FakeResponse())
+    # 試行の失敗で再び open になり、再試行は送信せずに遮断される
+    with pytest.raises(CircuitOpenError):
+        client.request("GET", ORDER_URL)
+    assert breaker.state == "open"
+    assert len(calls) == 3
+
+
+def test_breaker_half_open_rejects_other_calls_during_trial(clock, stub):
+    client = new_client(failure_threshold=2, reset_timeout=60)
+    breaker = open_breaker(client, stub)
+    clock.now += 61
+    assert breaker.allow() is True
+    assert breaker.state == "half_open"
+    assert breaker.allow() is False
+
+
+def test_breaker_half_open_trial_exception_reopens(clock, stub):
+    client = new_client(failure_threshold=2, reset_timeout=60)
+    breaker = open_breaker(client, stub)
+    clock.now += 61
+
+    def prepare():
+        raise KeyError("API_SECRET")
+
+    with pytest.raises(KeyError):
+        client.request("POST", ORDER_URL, prepare=prepare, idempotent=False)
+    assert breaker.state == "open"
+
+
+# --- 実行期限 ---
+def test_deadline_expired_before_send(clock, stub):
+    client = new_client()
+    client.set_run_deadline(10)
+    clock.now += 11
+    calls = stub(FakeResponse())
+    with pytest.raises(DeadlineExceeded):
+        order(client)
+    assert calls == []
+
+
+def test_deadline_expires_between_attempts(clock, stub, monkeypatch):
+    client = new_client()
+    client.set_run_deadline(10)
+    monkeypatch.setattr(client, "_backoff", lambda attempt: 4.0)
+    calls = stub(FakeResponse(503), FakeResponse(503), FakeResponse())
+    clock.now += 3
+    # 1回目の拒否後は残り7秒で4秒待機して再送、2回目の拒否後は残り3秒で待機できない
+    with pytest.raises(DeadlineExceeded):
+        order(client)
+    assert len(calls) == 2
+    assert clock.sleeps == [4.0]
+    assert client.metrics()["deadline_exceeded"] == 1
+
+
+def test_call_timeout_is_capped_by_remaining_deadline(clock, monkeypatch):
+    timeouts = []
+
+    def request(method, url, timeout=None, **kwargs):
+        timeouts.append(timeout)
+        return FakeResponse()
+
+    monkeypatch.setattr(resilience.requests, "request", request)
+    client = new_client()
+    client.set_run_deadline(10)
+    clock.now += 8
+    order(client)
+    assert timeouts == [pytest.approx(2.0)]